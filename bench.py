@@ -0,0 +1,249 @@
+"""Load test for the polling and posting path, against the local X and
+Telegram stand-ins in mock_servers.py.
+
+    python bench.py                                  # 10, 100 and 1000 accounts
+    python bench.py --accounts 100 --duration 120 --mode search --tokens 3
+    python bench.py --latency 0.05 --jitter 0.1 --burst-every 30 --telegram-throttle-every 50
+
+Accounts are spread over --channels Telegram channels, since one channel
+takes only about 20 posts a minute (TELEGRAM_CHAT_RATE). Each account
+count runs in a fresh process with its own state database:
+
+1. bootstrap: get_latest_tweet for every account through the token
+   scheduler, as the bot does for accounts without a cursor;
+2. steady state: the real poller runs for --duration seconds while the
+   mock posts tweets at --tweet-rate, then gets --drain seconds to catch up.
+
+Reported per run: tweets delivered per second, detection latency (tweet
+creation to Telegram receiving it) percentiles, X API calls and 429s per
+delivered tweet, how evenly requests spread over the tokens, and the
+bot's own per-stage latency summary. Bot settings (MIN_POLL_INTERVAL,
+HEDGE_REQUESTS, MAX_IN_FLIGHT, ...) come from the environment as usual,
+so runs before and after a change can be compared.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import mock_servers
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", default="10,100,1000", help="comma-separated account counts, one run each")
+    parser.add_argument("--mode", default="timeline", choices=("timeline", "search"), help="POLL_MODE for the run")
+    parser.add_argument("--tokens", type=int, default=3, help="bearer tokens (1-5)")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of steady-state polling")
+    parser.add_argument("--drain", type=float, default=15.0, help="seconds to keep polling after tweets stop")
+    parser.add_argument("--channels", type=int, default=10, help="Telegram channels the accounts are routed to")
+    parser.add_argument("--tweet-rate", type=float, default=2.0, help="tweets per second across all accounts")
+    parser.add_argument("--media-share", type=float, default=0.2, help="fraction of tweets with a photo")
+    parser.add_argument("--rate-limit", type=int, default=900, help="X requests per token per endpoint per window")
+    parser.add_argument("--rate-window", type=float, default=900.0, help="X rate-limit window in seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every X response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds per X response")
+    parser.add_argument("--burst-every", type=float, default=None, help="start an X 429 burst every N seconds")
+    parser.add_argument("--burst-length", type=float, default=5.0, help="seconds each 429 burst lasts")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="seconds added to every Telegram call")
+    parser.add_argument("--telegram-throttle-every", type=int, default=None, help="answer every Nth Telegram call with 429")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON instead of a table")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own output")
+    parser.add_argument("--child", metavar="RESULT_PATH", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def x_calls(mock_x):
+    """{"ok": n, "rate_limited": n, "by_token": {token: n}} so far"""
+    with mock_x.lock:
+        requests = dict(mock_x.requests)
+    calls = {"ok": 0, "rate_limited": 0, "by_token": {}}
+    for (token, _, status), count in requests.items():
+        calls["rate_limited" if status == 429 else "ok"] += count
+        calls["by_token"][token] = calls["by_token"].get(token, 0) + count
+    return calls
+
+
+def calls_since(after, before):
+    return {
+        "ok": after["ok"] - before["ok"],
+        "rate_limited": after["rate_limited"] - before["rate_limited"],
+        "by_token": {t: n - before["by_token"].get(t, 0) for t, n in after["by_token"].items()},
+    }
+
+
+async def run_bot(args, count, mock_x, mock_tg):
+    """Drive the bot in this process; mock servers and environment are already set up"""
+    import main
+
+    usernames = [u["username"] for u in mock_x.users.values()]
+    async with main.state_lock:
+        main.config["telegram_channel"] = "@bench0"
+        main.store.set_setting("telegram_channel", "@bench0")
+        for i, user in enumerate(mock_x.users.values()):
+            # Round-robin over the channels: Telegram allows one channel ~20 posts a minute
+            channels = [f"@bench{i % args.channels}"]
+            account = {"x_user_id": user["id"], "x_username": user["username"], "last_tweet_id": None, "channels": channels}
+            main.config["accounts"].append(account)
+            main.store.add_account(account)
+            main.store.set_routes(user["id"], channels)
+    await main.start_engine()
+
+    # Bootstrap: the latest tweet of every account, as for accounts without a cursor
+    semaphore = asyncio.Semaphore(main.MAX_IN_FLIGHT)
+
+    async def bootstrap(account):
+        async with semaphore:
+            tweet = await main.get_latest_tweet(account["x_user_id"])
+        if tweet:
+            account["last_tweet_id"] = tweet.id
+            main.store.set_cursor(account["x_user_id"], tweet.id)
+        return tweet is not None
+
+    before = x_calls(mock_x)
+    started = time.time()
+    bootstrapped = await asyncio.gather(*(bootstrap(a) for a in main.config["accounts"]))
+    bootstrap_seconds = time.time() - started
+    bootstrap_calls = calls_since(x_calls(mock_x), before)
+
+    # Steady state: the real poller against live tweets
+    before = x_calls(mock_x)
+    sent_before = len(mock_tg.sent)
+    started = time.time()
+    stop_at = started + args.duration
+    threading.Thread(
+        target=mock_servers.generate_tweets, args=(mock_x, args.tweet_rate, args.media_share, stop_at), daemon=True
+    ).start()
+    poller = asyncio.create_task(main.run_poller())
+    await asyncio.sleep(args.duration + args.drain)
+    poller.cancel()
+    steady_calls = calls_since(x_calls(mock_x), before)
+
+    posted = {
+        tweet["id"]
+        for timeline in mock_x.timelines.values() for tweet in timeline
+        if started <= main.snowflake_time(tweet["id"]) <= stop_at
+    }
+    delivered_at = {}
+    for received_at, _, _, text in mock_tg.sent[sent_before:]:
+        for tweet_id in re.findall(r"/status/(\d+)", text or ""):
+            if tweet_id in posted and tweet_id not in delivered_at:
+                delivered_at[tweet_id] = received_at
+    latencies = sorted(at - main.snowflake_time(tweet_id) for tweet_id, at in delivered_at.items())
+    delivered = len(delivered_at)
+    calls = steady_calls["ok"] + steady_calls["rate_limited"]
+    return {
+        "accounts": count,
+        "mode": args.mode,
+        "tokens": args.tokens,
+        "channels": args.channels,
+        "bootstrap": {
+            "seconds": round(bootstrap_seconds, 2),
+            "accounts_per_second": round(len(usernames) / bootstrap_seconds, 1) if bootstrap_seconds else None,
+            "failed": bootstrapped.count(False),
+            "x_calls": bootstrap_calls,
+        },
+        "posted": len(posted),
+        "delivered": delivered,
+        "tweets_per_second": round(delivered / args.duration, 2),
+        "telegram_messages": len(mock_tg.sent) - sent_before,
+        "telegram_throttled": mock_tg.throttled,
+        "detection_latency": {f"p{q}": main.percentile(latencies, q) for q in (50, 95, 99)},
+        "x_calls": steady_calls,
+        "x_calls_per_tweet": round(calls / delivered, 2) if delivered else None,
+        "stages": main.latency_tracer.summary(),
+    }
+
+
+def run_child(args):
+    count = int(args.accounts)
+    mock_x = mock_servers.MockX(
+        [f"bench{i}" for i in range(count)],
+        rate_limit=args.rate_limit, rate_window=args.rate_window, latency=args.latency, jitter=args.jitter,
+        burst_every=args.burst_every, burst_length=args.burst_length,
+    )
+    for user in mock_x.users.values():
+        mock_x.post_tweet(user["username"])
+    mock_tg = mock_servers.MockTelegram(latency=args.telegram_latency, throttle_every=args.telegram_throttle_every)
+    x_server = mock_servers.start_server(mock_x)
+    tg_server = mock_servers.start_server(mock_tg)
+
+    # main reads its settings at import time; run where no config.json gets imported
+    os.chdir(tempfile.mkdtemp(prefix="bench-"))
+    os.environ.update({
+        "X_API_BASE": f"http://127.0.0.1:{x_server.server_address[1]}",
+        "TELEGRAM_API_BASE": f"http://127.0.0.1:{tg_server.server_address[1]}",
+        "STATE_DB": os.path.abspath("state.db"),
+        "POLL_MODE": args.mode,
+    })
+    for i in range(1, args.tokens + 1):
+        os.environ[f"X_BEARER_TOKEN_{i}"] = f"bench-token-{i}"
+    # Let the poll planner start from the mock's budget; headers take over after the first call
+    scaled_limit = str(int(args.rate_limit * 900 / args.rate_window))
+    os.environ.setdefault("X_TIMELINE_LIMIT", scaled_limit)
+    os.environ.setdefault("X_SEARCH_LIMIT", scaled_limit)
+
+    result = asyncio.run(run_bot(args, count, mock_x, mock_tg))
+    with open(args.child, "w") as f:
+        json.dump(result, f)
+
+
+def seconds(value):
+    return "-" if value is None else f"{value:.1f}s"
+
+
+def print_table(results):
+    columns = ("accounts", "posted", "delivered", "tweets/s", "detect p50", "p95", "p99",
+               "X calls", "429s", "calls/tweet", "bootstrap")
+    rows = [
+        (r["accounts"], r["posted"], r["delivered"], r["tweets_per_second"],
+         seconds(r["detection_latency"]["p50"]), seconds(r["detection_latency"]["p95"]),
+         seconds(r["detection_latency"]["p99"]),
+         r["x_calls"]["ok"] + r["x_calls"]["rate_limited"], r["x_calls"]["rate_limited"],
+         "-" if r["x_calls_per_tweet"] is None else r["x_calls_per_tweet"],
+         f"{r['bootstrap']['seconds']}s ({r['bootstrap']['failed']} failed)")
+        for r in results
+    ]
+    widths = [max(len(str(v)) for v in column) for column in zip(columns, *rows)]
+    for row in (columns, *rows):
+        print("  ".join(str(v).rjust(w) for v, w in zip(row, widths)))
+    for r in results:
+        spread = ", ".join(f"{t.rsplit('-', 1)[-1]}: {n}" for t, n in sorted(r["x_calls"]["by_token"].items()))
+        stages = ", ".join(f"{s} {seconds(v['p50'])}" for s, v in r["stages"].items())
+        print(f"\n{r['accounts']} accounts ({r['mode']}, {r['tokens']} tokens, {r['channels']} channels): "
+              f"requests per token {spread or '-'}")
+        print(f"  bot stage p50: {stages}; Telegram {r['telegram_messages']} messages, {r['telegram_throttled']} throttled")
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        return run_child(args)
+
+    results = []
+    for count in [int(n) for n in args.accounts.split(",")]:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            result_path = f.name
+        if not args.json:
+            print(f"Running {count} accounts for {args.duration + args.drain:.0f}s...", file=sys.stderr)
+        output = None if args.verbose else subprocess.DEVNULL
+        argv = [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--accounts", str(count), "--child", result_path]
+        subprocess.run(argv, stdout=output, check=True)
+        with open(result_path) as f:
+            results.append(json.load(f))
+        os.remove(result_path)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
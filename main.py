@@ -1,36 +1,715 @@
-import requests
+import httpx
 import time
 import threading
 import json
 import os
 import re
-from typing import Optional, Dict, Any, TypedDict, cast
-from flask import Flask
-from telegram.update import Update
+import asyncio
+import heapq
+import itertools
+import math
+import bisect
+import hashlib
+from datetime import datetime, timezone
+from collections import deque, OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, TypedDict, cast
+import sqlite3
+import atexit
+import hmac
+import secrets
+from flask import Flask, Response, request
+from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes
 
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    import orjson  # Optional: decodes X responses several times faster
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 # ====== CONFIG FILE ======
 CONFIG_FILE = "config.json"
 
+class AccountState(TypedDict):
+    x_user_id: str
+    x_username: str
+    last_tweet_id: Optional[str]
+    # Telegram channels this account posts to; empty means the default channel
+    channels: List[str]
+
 class Config(TypedDict):
-    x_user_id: Optional[str]
-    x_username: Optional[str]
+    accounts: List[AccountState]
     telegram_channel: Optional[str]
-    last_tweet_id: Optional[str]
 
-def load_config() -> Config:
+def load_config() -> Optional[Config]:
+    """Read the legacy config.json, used once to seed the state database"""
+    if not os.path.exists(CONFIG_FILE):
+        return None
     try:
         with open(CONFIG_FILE, "r") as f:
             data = json.load(f)
-            return cast(Config, data)
-    except:
-        return {"x_user_id": None, "x_username": None, "telegram_channel": None, "last_tweet_id": None}
+    except Exception as e:
+        print(f"❌ Could not read {CONFIG_FILE}, not importing it: {e}")
+        return None
+
+    # Migrate the old single-account layout into the accounts list
+    if "accounts" not in data:
+        accounts = []
+        if data.get("x_user_id"):
+            accounts.append({
+                "x_user_id": data["x_user_id"],
+                "x_username": data.get("x_username") or "",
+                "last_tweet_id": data.get("last_tweet_id"),
+                "channels": [],
+            })
+        data = {"accounts": accounts, "telegram_channel": data.get("telegram_channel")}
+    return cast(Config, data)
+
+# ====== STATE STORE ======
+STATE_DB = os.getenv("STATE_DB", "state.db")
+# How often staged cursor updates are group-committed, in seconds
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "1.0"))
+# Delivered tweet IDs remembered per channel for duplicate suppression
+DEDUP_CAPACITY = int(os.getenv("DEDUP_CAPACITY", "10000"))
+# How long a resolved username <-> user ID pair is trusted before re-checking
+USERNAME_CACHE_TTL = float(os.getenv("USERNAME_CACHE_TTL", str(24 * 3600)))
+# Media URL -> Telegram file_id pairs kept so reposted media isn't fetched again
+MEDIA_CACHE_CAPACITY = int(os.getenv("MEDIA_CACHE_CAPACITY", "10000"))
+# Recent per-tweet latency traces kept for /latency
+TRACE_CAPACITY = int(os.getenv("TRACE_CAPACITY", "1000"))
+# How long an outbox message that kept failing waits before it is sent again
+OUTBOX_RETRY_DELAY = float(os.getenv("OUTBOX_RETRY_DELAY", "60"))
+# Sharded mode: every process sharing STATE_DB with its own WORKER_ID polls
+# only its share of the accounts (see ShardCoordinator)
+WORKER_ID = os.getenv("WORKER_ID", "")
+# How long a worker's heartbeat and its account leases last without renewal
+LEASE_TTL = float(os.getenv("LEASE_TTL", "30"))
+
+def snowflake(tweet_id) -> int:
+    """Tweet IDs are 64-bit snowflakes: compare them as integers, never as strings"""
+    return int(tweet_id)
+
+def snowflake_time(tweet_id) -> float:
+    """Unix time a tweet ID was minted, from the snowflake's timestamp bits"""
+    return ((snowflake(tweet_id) >> 22) + 1288834974657) / 1000
+
+class StateStore:
+    """SQLite (WAL) store for settings, per-account cursors and the outbox.
+
+    Settings and account list changes commit immediately. Cursor updates,
+    outbox messages and acks from the poller are staged in memory and
+    written together by flush(), so a busy cycle costs one small
+    transaction instead of a file rewrite. Several worker processes may
+    share one database; outbox rows belong to the worker that staged them.
+
+    flush() and the sharding writes run on a connection of their own
+    under _tx_lock, not _lock: they may wait on another worker's write
+    transaction, and staging from the event loop must not wait with them.
+    """
+
+    # Outbox IDs reserved from the shared counter at a time
+    OUTBOX_ID_BLOCK = 1000
 
-def save_config(cfg: Config) -> None:
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(cfg, f, indent=2)
+    def __init__(self, path, worker_id=""):
+        self.worker_id = worker_id
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Reentrant so batch() can hold it across several staging calls
+        self._lock = threading.RLock()
+        self._pending_cursors: Dict[str, str] = {}
+        self._pending_deliveries: List[tuple] = []
+        self._pending_media: Dict[str, str] = {}
+        self._pending_outbox: List[tuple] = []
+        self._pending_acks: List[int] = []
+        self._pending_failures: List[tuple] = []
+        # Staged outbox IDs not yet on disk
+        self._uncommitted_outbox: set = set()
+        self._inserts_since_prune: Dict[str, int] = {}
+        self._media_since_prune = 0
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS accounts (
+                x_user_id TEXT PRIMARY KEY,
+                x_username TEXT NOT NULL,
+                last_tweet_id TEXT
+            );
+            CREATE TABLE IF NOT EXISTS usernames (
+                username TEXT PRIMARY KEY,
+                x_user_id TEXT NOT NULL,
+                display_username TEXT NOT NULL,
+                resolved_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS usernames_by_id ON usernames (x_user_id);
+            CREATE TABLE IF NOT EXISTS delivered (
+                channel TEXT NOT NULL,
+                tweet_id INTEGER NOT NULL,
+                PRIMARY KEY (channel, tweet_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS routes (
+                x_user_id TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                PRIMARY KEY (x_user_id, channel)
+            );
+            CREATE TABLE IF NOT EXISTS media_files (
+                media_key TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                used_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY,
+                chat_id TEXT NOT NULL,
+                method TEXT NOT NULL,
+                data TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                error TEXT,
+                created_at REAL NOT NULL,
+                worker TEXT NOT NULL DEFAULT ''
+            );
+            CREATE TABLE IF NOT EXISTS workers (
+                worker_id TEXT PRIMARY KEY,
+                heartbeat_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS leases (
+                x_user_id TEXT PRIMARY KEY,
+                worker_id TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS token_budgets (
+                token TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                rate_limit INTEGER,
+                remaining INTEGER,
+                reset_at REAL NOT NULL,
+                observed_at REAL NOT NULL,
+                PRIMARY KEY (token, endpoint)
+            );
+        """)
+        if "worker" not in [row[1] for row in self._db.execute("PRAGMA table_info(outbox)")]:
+            self._db.execute("ALTER TABLE outbox ADD COLUMN worker TEXT NOT NULL DEFAULT ''")
+        # Background write transactions; lock order is _tx_lock, then _lock
+        self._tx_db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._tx_lock = threading.Lock()
+        # Outbox IDs are handed out to stagers from blocks reserved in the
+        # database, so workers never hand out the same one
+        self._next_outbox_id = 0
+        self._outbox_id_limit = 0
+        self._id_lock = threading.Lock()
+
+    def is_empty(self):
+        with self._lock:
+            settings = self._db.execute("SELECT COUNT(*) FROM settings").fetchone()[0]
+            accounts = self._db.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+        return settings == 0 and accounts == 0
+
+    def load(self) -> Config:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT x_user_id, x_username, last_tweet_id FROM accounts ORDER BY rowid"
+            ).fetchall()
+            channel = self._db.execute(
+                "SELECT value FROM settings WHERE key = 'telegram_channel'"
+            ).fetchone()
+            routes = self._db.execute("SELECT x_user_id, channel FROM routes ORDER BY rowid").fetchall()
+        channels: Dict[str, List[str]] = {}
+        for user_id, route_channel in routes:
+            channels.setdefault(user_id, []).append(route_channel)
+        accounts = [
+            {"x_user_id": r[0], "x_username": r[1], "last_tweet_id": r[2], "channels": channels.get(r[0], [])}
+            for r in rows
+        ]
+        return {"accounts": cast(List[AccountState], accounts), "telegram_channel": channel[0] if channel else None}
+
+    def import_config(self, cfg: Config):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO settings (key, value) VALUES ('telegram_channel', ?)",
+                    (cfg.get("telegram_channel"),),
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO accounts (x_user_id, x_username, last_tweet_id) VALUES (?, ?, ?)",
+                    [(a["x_user_id"], a["x_username"], a.get("last_tweet_id")) for a in cfg["accounts"]],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def set_setting(self, key, value):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+
+    def add_account(self, account: AccountState):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO accounts (x_user_id, x_username, last_tweet_id) VALUES (?, ?, ?)",
+                (account["x_user_id"], account["x_username"], account.get("last_tweet_id")),
+            )
+
+    def remove_account(self, user_id):
+        # _tx_lock too, so a flush already under way can't write its cursor back
+        with self._tx_lock, self._lock:
+            self._pending_cursors.pop(user_id, None)
+            self._db.execute("DELETE FROM accounts WHERE x_user_id = ?", (user_id,))
+            self._db.execute("DELETE FROM routes WHERE x_user_id = ?", (user_id,))
+
+    def replace_accounts(self, accounts: List[AccountState]):
+        with self._tx_lock, self._lock:
+            self._pending_cursors.clear()
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM accounts")
+                self._db.execute("DELETE FROM routes")
+                self._db.executemany(
+                    "INSERT INTO accounts (x_user_id, x_username, last_tweet_id) VALUES (?, ?, ?)",
+                    [(a["x_user_id"], a["x_username"], a.get("last_tweet_id")) for a in accounts],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def set_routes(self, user_id, channels):
+        """Post this account's tweets to `channels`, in order (empty: the default channel)"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM routes WHERE x_user_id = ?", (user_id,))
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO routes (x_user_id, channel) VALUES (?, ?)",
+                    [(user_id, channel) for channel in channels],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def set_cursor(self, user_id, tweet_id):
+        """Stage a cursor update; it is written by the next flush()"""
+        with self._lock:
+            self._pending_cursors[user_id] = tweet_id
+
+    def cached_users(self, usernames, fresh_after):
+        """Cached {lowercase username: (user_id, username)} resolved after fresh_after"""
+        found = {}
+        with self._lock:
+            for name in usernames:
+                row = self._db.execute(
+                    "SELECT x_user_id, display_username FROM usernames WHERE username = ? AND resolved_at > ?",
+                    (name.lower(), fresh_after),
+                ).fetchone()
+                if row:
+                    found[name.lower()] = (row[0], row[1])
+        return found
+
+    def cache_users(self, users):
+        """Remember resolved (user_id, username) pairs, replacing old names for those IDs"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany("DELETE FROM usernames WHERE x_user_id = ?", [(u[0],) for u in users])
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO usernames (username, x_user_id, display_username, resolved_at) VALUES (?, ?, ?, ?)",
+                    [(username.lower(), user_id, username, now) for user_id, username in users],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def stale_user_ids(self, user_ids, fresh_after):
+        """Those of user_ids with no username resolved after fresh_after"""
+        with self._lock:
+            return [
+                user_id for user_id in user_ids
+                if not self._db.execute(
+                    "SELECT 1 FROM usernames WHERE x_user_id = ? AND resolved_at > ?", (user_id, fresh_after)
+                ).fetchone()
+            ]
+
+    def rename_account(self, user_id, username):
+        with self._lock:
+            self._db.execute("UPDATE accounts SET x_username = ? WHERE x_user_id = ?", (username, user_id))
+
+    def record_delivered(self, channel, tweet_id):
+        """Stage a delivered tweet for the dedup table; written by flush()"""
+        with self._lock:
+            self._pending_deliveries.append((channel, snowflake(tweet_id)))
+
+    def record_media(self, media_key, file_id):
+        """Stage a media -> file_id pair for the media cache; written by flush()"""
+        with self._lock:
+            self._pending_media[media_key] = file_id
+
+    def recent_media(self, limit):
+        """The `limit` most recently used (media_key, file_id) pairs, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT media_key, file_id FROM media_files ORDER BY used_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return rows[::-1]
+
+    def batch(self):
+        """Hold off flush() so the changes staged inside commit together"""
+        return self._lock
+
+    def stage_outbox(self, batches, outbox_ids):
+        """Stage rendered [[(method, data)], ...] for durable delivery; written by flush().
+
+        Every message gets one of `outbox_ids`, from take_outbox_ids() or
+        reserve_outbox_ids(). All batches are staged or, on error, none.
+        Returns [[(outbox_id, chat_id, method, data)], ...] in the same order.
+        """
+        if sum(len(messages) for messages in batches) != len(outbox_ids):
+            raise ValueError(f"{len(outbox_ids)} outbox IDs for {sum(len(m) for m in batches)} messages")
+        ids = iter(outbox_ids)
+        now = time.time()
+        staged = [
+            [(next(ids), str(data["chat_id"]), method, data) for method, data in messages]
+            for messages in batches
+        ]
+        rows = [
+            (outbox_id, chat_id, method, json.dumps(data), now, self.worker_id)
+            for messages in staged for outbox_id, chat_id, method, data in messages
+        ]
+        with self._lock:
+            self._pending_outbox.extend(rows)
+            self._uncommitted_outbox.update(outbox_ids)
+        return staged
+
+    def take_outbox_ids(self, count) -> Optional[List[int]]:
+        """`count` outbox IDs from the reserved block, or None if it runs short"""
+        with self._lock:
+            if self._outbox_id_limit - self._next_outbox_id < count:
+                return None
+            start = self._next_outbox_id
+            self._next_outbox_id += count
+        return list(range(start + 1, start + count + 1))
+
+    def reserve_outbox_ids(self, count) -> List[int]:
+        """`count` outbox IDs, reserving a new block in the database if needed.
+
+        May wait on other workers' write transactions, so call it off the
+        event loop.
+        """
+        with self._id_lock:
+            ids = self.take_outbox_ids(count)
+            if ids is not None:
+                return ids
+            size = max(count, self.OUTBOX_ID_BLOCK)
+            with self._tx_lock:
+                start = self._reserve_outbox_block(size)
+            with self._lock:
+                # Whatever is left of the old block is skipped; IDs only need to be unique
+                self._next_outbox_id, self._outbox_id_limit = start + count, start + size
+        return list(range(start + 1, start + count + 1))
+
+    def _reserve_outbox_block(self, size):
+        db = self._tx_db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT value FROM settings WHERE key = 'outbox_id_block'").fetchone()
+            highest = db.execute("SELECT COALESCE(MAX(id), 0) FROM outbox").fetchone()[0]
+            start = max(int(row[0]) if row else 0, highest)
+            db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('outbox_id_block', ?)", (str(start + size),))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return start
+
+    def is_committed(self, outbox_id):
+        return outbox_id not in self._uncommitted_outbox
+
+    def ack_outbox(self, outbox_id):
+        """Telegram confirmed the message: drop it from the outbox on the next flush()"""
+        with self._lock:
+            self._pending_acks.append(outbox_id)
+
+    def fail_outbox(self, outbox_id, error):
+        """Telegram refused the message: keep it for inspection but stop sending it"""
+        with self._lock:
+            self._pending_failures.append((error, outbox_id))
+
+    def pending_outbox(self):
+        """This worker's committed messages still waiting for Telegram, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, chat_id, method, data FROM outbox WHERE status = 'pending' AND worker = ? ORDER BY id",
+                (self.worker_id,),
+            ).fetchall()
+        return [(outbox_id, chat_id, method, json.loads(data)) for outbox_id, chat_id, method, data in rows]
+
+    def outbox_counts(self):
+        """{status: message count} of the committed outbox"""
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def heartbeat(self, worker_id, now) -> bool:
+        """Mark a worker alive; False if it had no row (new, or reaped as dead)"""
+        with self._tx_lock:
+            updated = self._tx_db.execute(
+                "UPDATE workers SET heartbeat_at = ? WHERE worker_id = ?", (now, worker_id)
+            ).rowcount
+            if not updated:
+                self._tx_db.execute("INSERT OR REPLACE INTO workers (worker_id, heartbeat_at) VALUES (?, ?)", (worker_id, now))
+            return bool(updated)
+
+    def live_workers(self, alive_after) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT worker_id FROM workers WHERE heartbeat_at > ? ORDER BY worker_id", (alive_after,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def reap_workers(self, worker_id, dead_before):
+        """Remove workers that stopped heartbeating and adopt their pending outbox.
+
+        Each dead worker is reaped by exactly one caller. Returns (dead
+        worker IDs, adopted [(outbox_id, chat_id, method, data)]).
+        """
+        with self._tx_lock:
+            self._tx_db.execute("BEGIN IMMEDIATE")
+            try:
+                dead = [row[0] for row in self._tx_db.execute(
+                    "SELECT worker_id FROM workers WHERE heartbeat_at <= ?", (dead_before,)
+                ).fetchall()]
+                adopted = []
+                for dead_worker in dead:
+                    self._tx_db.execute("DELETE FROM workers WHERE worker_id = ?", (dead_worker,))
+                    adopted += self._tx_db.execute(
+                        "SELECT id, chat_id, method, data FROM outbox WHERE status = 'pending' AND worker = ? ORDER BY id",
+                        (dead_worker,),
+                    ).fetchall()
+                    self._tx_db.execute("UPDATE outbox SET worker = ? WHERE worker = ?", (worker_id, dead_worker))
+                self._tx_db.execute("COMMIT")
+            except Exception:
+                self._tx_db.execute("ROLLBACK")
+                raise
+        return dead, [(outbox_id, chat_id, method, json.loads(data)) for outbox_id, chat_id, method, data in adopted]
+
+    def sync_leases(self, worker_id, user_ids, now, expires_at) -> set:
+        """Hold leases on exactly these accounts, as far as they are free.
+
+        Renews the worker's own leases, takes ones that are unowned or
+        expired and releases the rest. Returns the accounts now leased.
+        """
+        with self._tx_lock:
+            self._tx_db.execute("BEGIN IMMEDIATE")
+            try:
+                self._tx_db.executemany("""
+                    INSERT INTO leases (x_user_id, worker_id, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT (x_user_id) DO UPDATE SET worker_id = excluded.worker_id, expires_at = excluded.expires_at
+                    WHERE leases.worker_id = excluded.worker_id OR leases.expires_at <= ?
+                """, [(user_id, worker_id, expires_at, now) for user_id in user_ids])
+                held = {row[0] for row in self._tx_db.execute(
+                    "SELECT x_user_id FROM leases WHERE worker_id = ?", (worker_id,)
+                ).fetchall()}
+                released = held - set(user_ids)
+                self._tx_db.executemany(
+                    "DELETE FROM leases WHERE x_user_id = ? AND worker_id = ?", [(user_id, worker_id) for user_id in released]
+                )
+                self._tx_db.execute("COMMIT")
+            except Exception:
+                self._tx_db.execute("ROLLBACK")
+                raise
+        return held - released
+
+    def cursors(self, user_ids) -> Dict[str, Optional[str]]:
+        """Committed last_tweet_id of these accounts"""
+        with self._lock:
+            return {
+                user_id: row[0]
+                for user_id in user_ids
+                for row in self._db.execute("SELECT last_tweet_id FROM accounts WHERE x_user_id = ?", (user_id,))
+            }
+
+    def share_budgets(self, observations):
+        """Publish rate-limit observations and return every worker's latest.
+
+        Rows are (token, endpoint, rate_limit, remaining, reset_at,
+        observed_at); a row only replaces an older observation.
+        """
+        with self._tx_lock:
+            self._tx_db.execute("BEGIN IMMEDIATE")
+            try:
+                self._tx_db.executemany("""
+                    INSERT INTO token_budgets (token, endpoint, rate_limit, remaining, reset_at, observed_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (token, endpoint) DO UPDATE SET
+                        rate_limit = excluded.rate_limit, remaining = excluded.remaining,
+                        reset_at = excluded.reset_at, observed_at = excluded.observed_at
+                    WHERE excluded.observed_at > token_budgets.observed_at
+                """, observations)
+                rows = self._tx_db.execute(
+                    "SELECT token, endpoint, rate_limit, remaining, reset_at, observed_at FROM token_budgets"
+                ).fetchall()
+                self._tx_db.execute("COMMIT")
+            except Exception:
+                self._tx_db.execute("ROLLBACK")
+                raise
+        return rows
 
-config: Config = load_config()
+    def recent_deliveries(self, per_channel):
+        """The newest `per_channel` delivered IDs of every channel, oldest first"""
+        with self._lock:
+            rows = self._db.execute("""
+                SELECT channel, tweet_id FROM (
+                    SELECT channel, tweet_id,
+                           ROW_NUMBER() OVER (PARTITION BY channel ORDER BY tweet_id DESC) AS n
+                    FROM delivered
+                ) WHERE n <= ? ORDER BY tweet_id
+            """, (per_channel,)).fetchall()
+        return rows
+
+    def flush(self):
+        """Group-commit every staged cursor, delivery and outbox change in one transaction"""
+        with self._tx_lock:
+            # Take the staged changes; stagers carry on into fresh buffers meanwhile
+            with self._lock:
+                if not (self._pending_cursors or self._pending_deliveries or self._pending_media
+                        or self._pending_outbox or self._pending_acks or self._pending_failures):
+                    return 0
+                cursors, self._pending_cursors = self._pending_cursors, {}
+                deliveries, self._pending_deliveries = self._pending_deliveries, []
+                media_files, self._pending_media = self._pending_media, {}
+                outbox, self._pending_outbox = self._pending_outbox, []
+                acks, self._pending_acks = self._pending_acks, []
+                failures, self._pending_failures = self._pending_failures, []
+            updates = [(tweet_id, user_id) for user_id, tweet_id in cursors.items()]
+            now = time.time()
+            media = [(media_key, file_id, now) for media_key, file_id in media_files.items()]
+            db = self._tx_db
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                try:
+                    db.executemany("UPDATE accounts SET last_tweet_id = ? WHERE x_user_id = ?", updates)
+                    db.executemany("INSERT OR IGNORE INTO delivered (channel, tweet_id) VALUES (?, ?)", deliveries)
+                    db.executemany("INSERT OR REPLACE INTO media_files (media_key, file_id, used_at) VALUES (?, ?, ?)", media)
+                    db.executemany(
+                        "INSERT INTO outbox (id, chat_id, method, data, created_at, worker) VALUES (?, ?, ?, ?, ?, ?)",
+                        outbox,
+                    )
+                    db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in acks])
+                    db.executemany("UPDATE outbox SET status = 'failed', error = ? WHERE id = ?", failures)
+                    self._prune_delivered(deliveries)
+                    self._prune_media(len(media))
+                    db.execute("COMMIT")
+                except Exception:
+                    db.execute("ROLLBACK")
+                    raise
+            except Exception:
+                # Put the changes back in front of anything staged since, for the next flush
+                with self._lock:
+                    self._pending_cursors = {**cursors, **self._pending_cursors}
+                    self._pending_deliveries = deliveries + self._pending_deliveries
+                    self._pending_media = {**media_files, **self._pending_media}
+                    self._pending_outbox = outbox + self._pending_outbox
+                    self._pending_acks = acks + self._pending_acks
+                    self._pending_failures = failures + self._pending_failures
+                raise
+            with self._lock:
+                self._uncommitted_outbox.difference_update(row[0] for row in outbox)
+            return len(updates) + len(deliveries) + len(media) + len(outbox) + len(acks)
+
+    def _prune_delivered(self, deliveries):
+        # Trim a channel back to DEDUP_CAPACITY once it has grown by a tenth,
+        # keeping the table bounded without scanning it on every commit
+        for channel, _ in deliveries:
+            self._inserts_since_prune[channel] = self._inserts_since_prune.get(channel, 0) + 1
+        for channel, count in list(self._inserts_since_prune.items()):
+            if count < max(DEDUP_CAPACITY // 10, 1):
+                continue
+            self._tx_db.execute("""
+                DELETE FROM delivered WHERE channel = ? AND tweet_id < (
+                    SELECT tweet_id FROM delivered WHERE channel = ?
+                    ORDER BY tweet_id DESC LIMIT 1 OFFSET ?
+                )
+            """, (channel, channel, DEDUP_CAPACITY - 1))
+            self._inserts_since_prune[channel] = 0
+
+    def _prune_media(self, inserted):
+        self._media_since_prune += inserted
+        if self._media_since_prune < max(MEDIA_CACHE_CAPACITY // 10, 1):
+            return
+        self._tx_db.execute("""
+            DELETE FROM media_files WHERE media_key NOT IN (
+                SELECT media_key FROM media_files ORDER BY used_at DESC LIMIT ?
+            )
+        """, (MEDIA_CACHE_CAPACITY,))
+        self._media_since_prune = 0
+
+store = StateStore(STATE_DB, WORKER_ID)
+if store.is_empty():
+    legacy_config = load_config()
+    if legacy_config:
+        store.import_config(legacy_config)
+        print(f"Imported {len(legacy_config['accounts'])} account(s) from {CONFIG_FILE} into {STATE_DB}")
+# Don't lose cursors staged since the last group commit on a clean exit
+atexit.register(store.flush)
+
+class DedupIndex:
+    """Bounded per-channel LRU of delivered tweet IDs with O(1) lookups"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._channels: Dict[str, OrderedDict] = {}
+
+    def seen(self, channel, tweet_id) -> bool:
+        delivered = self._channels.get(channel)
+        return delivered is not None and snowflake(tweet_id) in delivered
+
+    def add(self, channel, tweet_id):
+        delivered = self._channels.setdefault(channel, OrderedDict())
+        delivered[snowflake(tweet_id)] = None
+        delivered.move_to_end(snowflake(tweet_id))
+        if len(delivered) > self.capacity:
+            delivered.popitem(last=False)
+
+dedup_index = DedupIndex(DEDUP_CAPACITY)
+for delivered_channel, delivered_id in store.recent_deliveries(DEDUP_CAPACITY):
+    dedup_index.add(delivered_channel, delivered_id)
+
+config: Config = store.load()
+# Guards config and the store between the Telegram handlers and the poller,
+# which all run as tasks on one event loop
+state_lock = asyncio.Lock()
+# Outbox group commit: a sender sets flush_requested and waits on flush_done,
+# which flush_state() sets (and replaces) after each commit
+flush_requested = asyncio.Event()
+flush_done = asyncio.Event()
+
+async def wait_for_commit(outbox_id):
+    """Return once outbox row `outbox_id` is on disk"""
+    while not store.is_committed(outbox_id):
+        done = flush_done
+        flush_requested.set()
+        await done.wait()
+
+def find_account(user_id) -> Optional[AccountState]:
+    for account in config["accounts"]:
+        if account["x_user_id"] == user_id:
+            return account
+    return None
+
+def account_channels(account: AccountState, default_channel) -> List[str]:
+    """Where an account's tweets go: its own routes, else the default channel"""
+    if account.get("channels"):
+        return account["channels"]
+    return [default_channel] if default_channel else []
 
 # ====== TOKENS FROM ENVIRONMENT ======
 # Support for multiple X accounts (up to 5)
@@ -56,166 +735,1786 @@ if ADMIN_ID != 123456789:
     AUTHORIZED_USERS.add(ADMIN_ID)
 
 CHECK_INTERVAL = 60
-# Rate limit tracking for multiple accounts
-import datetime
-last_rate_limit_time = 0
-current_wait_time = 0
-current_token_index = 0  # Track which token we're currently using
-token_rate_limits = {}  # Track rate limits per token
-
-# Initialize rate limit tracking for each token
-for i, token in enumerate(X_BEARER_TOKENS):
-    token_rate_limits[i] = {'last_rate_limit': 0, 'wait_time': 0}
+# How many X accounts may be fetched at the same time
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "20"))
+# Upper bound on pages (100 tweets each) fetched when catching up one account
+MAX_CATCHUP_PAGES = int(os.getenv("MAX_CATCHUP_PAGES", "10"))
+# Outbound Telegram delivery: worker count, queue bound and send rates
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "8"))
+DELIVERY_QUEUE_SIZE = int(os.getenv("DELIVERY_QUEUE_SIZE", "1000"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # messages per second, all chats
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "20"))  # messages per minute, per chat
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+# Adaptive polling: per-account intervals are kept within these bounds
+MIN_POLL_INTERVAL = float(os.getenv("MIN_POLL_INTERVAL", "15"))
+MAX_POLL_INTERVAL = float(os.getenv("MAX_POLL_INTERVAL", "1800"))
+# Assumed posting rate of an account we have no history for yet
+PRIOR_TWEETS_PER_DAY = float(os.getenv("PRIOR_TWEETS_PER_DAY", "5"))
+# Timeline requests per 15 minute window per token, until X's headers tell us
+X_TIMELINE_LIMIT = int(os.getenv("X_TIMELINE_LIMIT", "900"))
+# Fraction of the token budget the poller plans to spend (rest is headroom)
+POLL_BUDGET_SHARE = float(os.getenv("POLL_BUDGET_SHARE", "0.9"))
+# "timeline" polls /2/users/{id}/tweets per account; "search" packs many
+# accounts into each /2/tweets/search/recent query; "stream" consumes the
+# filtered stream instead of polling
+POLL_MODE = os.getenv("POLL_MODE", "timeline")
+# Recent search requests per 15 minute window per token, until headers say otherwise
+X_SEARCH_LIMIT = int(os.getenv("X_SEARCH_LIMIT", "450"))
+# Longest search query the API tier accepts (512 on Basic, 1024 on Pro)
+SEARCH_QUERY_MAX_LEN = int(os.getenv("SEARCH_QUERY_MAX_LEN", "512"))
+# Filtered stream: rule length limit and how long silence means a dead
+# connection (X sends a keep-alive newline every 20 seconds)
+STREAM_RULE_MAX_LEN = int(os.getenv("STREAM_RULE_MAX_LEN", "512"))
+STREAM_STALL_TIMEOUT = float(os.getenv("STREAM_STALL_TIMEOUT", "30"))
+# Longest a request may wait for a token slot before the poll gives up
+TOKEN_MAX_WAIT = float(os.getenv("TOKEN_MAX_WAIT", str(CHECK_INTERVAL)))
+# Hedged X requests: when a request hasn't answered by this percentile of
+# recent latencies, send a duplicate on another token and take the first answer
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "90"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.25"))
+# Circuit breaker: consecutive failures before a token is skipped, and the
+# first pause (doubled on every failed probe, up to 15 minutes)
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
 # ====================
 
+# --- Metrics ---
+# Prometheus text-format metrics served on /metrics. Updated from the event
+# loop and read by the Flask thread, so each metric has its own lock.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Tweet-to-channel latency is dominated by polling gaps, so it needs longer buckets
+DELIVERY_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+class Metric:
+    """One metric family; samples are keyed by their label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, Any] = {}
+        metrics_registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """[(suffix, label names, label values, value)] for the exposition"""
+        with self._lock:
+            return [("", self.labels, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(names, values)} {float(value)!r}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        if not self.labels:
+            self._values[()] = 0.0
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(Metric):
+    """A value that is set directly, or read from `collect` at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), collect=None):
+        super().__init__(name, help_text, labels)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.collect is None:
+            return super().samples()
+        return [("", self.labels, key, value) for key, value in self.collect().items()]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        samples = []
+        names = self.labels + ("le",)
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append(("_bucket", names, key + (f"{bound:g}",), bucket_count))
+                samples.append(("_bucket", names, key + ("+Inf",), count))
+                samples.append(("_sum", self.labels, key, total))
+                samples.append(("_count", self.labels, key, count))
+        return samples
+
+metrics_registry: List[Metric] = []
+
+def render_metrics():
+    return "\n".join(metric.render() for metric in metrics_registry) + "\n"
+
+def collect_budgets(field):
+    """Per (token, endpoint) gauge values from the token scheduler's budgets"""
+    now = time.time()
+    values = {}
+    for (index, endpoint), budget in token_scheduler.snapshot().items():
+        if field == "reset_at":
+            values[(str(index + 1), endpoint)] = max(budget["reset_at"] - now, 0.0)
+        elif budget[field] is not None:
+            values[(str(index + 1), endpoint)] = budget[field]
+    return values
+
+X_REQUEST_SECONDS = Histogram("x_request_duration_seconds", "Latency of X API requests", ("endpoint",))
+X_REQUESTS = Counter("x_requests_total", "X API requests by bearer token, endpoint and HTTP status", ("token", "endpoint", "status"))
+X_RATE_LIMITED = Counter("x_rate_limited_total", "429 responses from X by bearer token and endpoint", ("token", "endpoint"))
+Gauge("x_rate_limit_remaining", "Requests left in the current rate-limit window", ("token", "endpoint"),
+      collect=lambda: collect_budgets("remaining"))
+Gauge("x_rate_limit_limit", "Requests allowed per rate-limit window", ("token", "endpoint"),
+      collect=lambda: collect_budgets("limit"))
+Gauge("x_rate_limit_reset_seconds", "Seconds until the rate-limit window resets", ("token", "endpoint"),
+      collect=lambda: collect_budgets("reset_at"))
+TELEGRAM_REQUEST_SECONDS = Histogram("telegram_request_duration_seconds", "Latency of Telegram Bot API calls", ("method",))
+TELEGRAM_REQUESTS = Counter("telegram_requests_total", "Telegram Bot API calls by method and HTTP status", ("method", "status"))
+POLL_SECONDS = Histogram("poll_duration_seconds", "Duration of one poll: an account's timeline or a packed search query", ("kind",))
+POLLS = Counter("polls_total", "Account polls by result", ("status",))
+POLL_IN_FLIGHT = Gauge("poll_jobs_in_flight", "Polls currently running in the background poller")
+Gauge("watched_accounts", "X accounts being watched", collect=lambda: {(): len(config["accounts"])})
+Gauge("delivery_queue_depth", "Telegram messages queued or being sent",
+      collect=lambda: {(): delivery_queue.depth if delivery_queue else 0})
+Gauge("delivery_queue_chats", "Chats with Telegram messages waiting",
+      collect=lambda: {(): len(delivery_queue.pending) if delivery_queue else 0})
+TWEETS_DELIVERED = Counter("tweets_delivered_total", "Tweets Telegram accepted every message of, counted per channel")
+Gauge("outbox_messages", "Messages in the durable outbox by status", ("status",),
+      collect=lambda: {(status,): count for status, count in store.outbox_counts().items()})
+TWEETS_FAILED = Counter("tweets_failed_total", "Tweets with a message Telegram did not accept, counted per channel")
+STREAM_CONNECTIONS = Counter("stream_connections_total", "Filtered stream connections opened")
+X_HEDGED = Counter("x_hedged_requests_total", "Slow X requests duplicated on a second token, by which answer won", ("endpoint", "winner"))
+Gauge("x_token_circuit_open", "1 while a bearer token is out of rotation after repeated failures", ("token",),
+      collect=lambda: {(str(i + 1),): 1.0 if i in token_scheduler.open_circuits() else 0.0 for i in range(len(X_BEARER_TOKENS))})
+Gauge("shard_live_workers", "Workers heartbeating into the shared state database",
+      collect=lambda: {(): len(shard_coordinator.workers) if shard_coordinator else 1})
+Gauge("shard_owned_accounts", "Accounts this worker holds leases on and polls",
+      collect=lambda: {(): len(shard_coordinator.owned) if shard_coordinator else len(config["accounts"])})
+TWEET_LATENCY_SECONDS = Histogram("tweet_latency_seconds", "Tweet delivery latency by stage (detect, fetch, render, send, total)",
+                                  ("stage",), buckets=DELIVERY_BUCKETS)
+
 # --- Flask keepalive server (for Replit + UptimeRobot) ---
+# "polling" long-polls getUpdates; "webhook" has Telegram POST updates to
+# WEBHOOK_URL + WEBHOOK_PATH on this Flask server instead
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Every instance behind a load balancer must share the same secret
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Only one process may long-poll getUpdates: when several workers run in
+# polling mode, set TELEGRAM_COMMANDS=false on all but one
+TELEGRAM_COMMANDS = os.getenv("TELEGRAM_COMMANDS", "true").lower() in ("1", "true", "yes")
+# Workers sharing a host each need their own port
+PORT = int(os.getenv("PORT", "5000"))
+
+# Set by main() once the Telegram application is running
+telegram_app: Optional[Application] = None
+main_loop: Optional[asyncio.AbstractEventLoop] = None
+
 app = Flask('')
 @app.route('/')
 def home():
     return "Bot is running!"
 
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/latency')
+def latency_report():
+    return latency_tracer.report()
+
+@app.route(WEBHOOK_PATH, methods=['POST'])
+def telegram_webhook():
+    # Telegram echoes the secret_token we registered in this header
+    received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    # Compared as bytes: compare_digest rejects non-ASCII strings with a TypeError
+    if not hmac.compare_digest(received.encode(), WEBHOOK_SECRET.encode()):
+        return "Forbidden", 403
+    if telegram_app is None or main_loop is None:
+        return "Not ready", 503
+
+    update = Update.de_json(request.get_json(force=True), telegram_app.bot)
+    # Handlers run concurrently on the main loop; answer Telegram right away
+    main_loop.call_soon_threadsafe(telegram_app.update_queue.put_nowait, update)
+    return "OK"
+
 def run_flask():
-    app.run(host='0.0.0.0', port=5000)
+    app.run(host='0.0.0.0', port=PORT)
+
+# --- HTTP clients ---
+# One pooled keep-alive client per API, so calls reuse TCP+TLS connections
+X_API_BASE = os.getenv("X_API_BASE", "https://api.twitter.com")
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+
+def make_http_client(base_url):
+    return httpx.AsyncClient(
+        base_url=base_url,
+        http2=HTTP2_AVAILABLE,
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=60,
+        ),
+    )
+
+x_http = make_http_client(X_API_BASE)
+telegram_http = make_http_client(f"{TELEGRAM_API_BASE}/bot{TELEGRAM_TOKEN}")
+
+async def x_api_get(path, token, params=None):
+    return await x_http.get(path, headers={"Authorization": f"Bearer {token}"}, params=params)
+
+async def x_api_post(path, token, payload):
+    return await x_http.post(path, headers={"Authorization": f"Bearer {token}"}, json=payload)
+
+async def telegram_api(method, data):
+    return await telegram_http.post(f"/{method}", data=data)
 
 # --- X API ---
-def get_next_available_token():
-    """Get the next available X token that isn't rate limited"""
-    global current_token_index
-    
+class CircuitBreaker:
+    """Takes a bearer token out of rotation after repeated failures.
+
+    Transport errors, 5xx and 401/403 count as failures; 429 doesn't, the
+    rate-limit budget handles it. Once tripped the token is skipped until
+    open_until, then a single probe request is let through: success
+    closes the breaker, failure reopens it for twice as long.
+    """
+
+    MAX_COOLDOWN = 900
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+
+    @property
+    def tripped(self):
+        return self.failures >= BREAKER_FAILURES
+
+    def failure(self, now):
+        self.failures += 1
+        if self.tripped:
+            # Exponent capped: a revoked token keeps failing for days, and 2.0 ** 1029 overflows
+            cooldown = BREAKER_COOLDOWN * 2 ** min(self.failures - BREAKER_FAILURES, 10)
+            self.open_until = now + min(cooldown, self.MAX_COOLDOWN)
+
+    def success(self):
+        self.failures = 0
+        self.open_until = 0.0
+
+    def probe(self, start):
+        """A tripped token was picked: hold the others back while it is tested"""
+        if self.tripped:
+            self.open_until = start + BREAKER_COOLDOWN
+
+class TokenScheduler:
+    """Routes X requests across bearer tokens using the rate-limit headers.
+
+    X limits each token per endpoint, so budgets are tracked per
+    (token, endpoint). Every response updates the budget from
+    x-rate-limit-limit/-remaining/-reset, and requests are paced so each
+    token's remaining budget is spread evenly over its reset window.
+    Sharded workers pace themselves on their `share` of each budget.
+    """
+
+    def __init__(self, token_count):
+        self.token_count = token_count
+        # Fraction of every budget this process may spend (1 / live workers)
+        self.share = 1.0
+        self._budgets = {}
+        self.breakers = [CircuitBreaker() for _ in range(token_count)]
+        self._lock = threading.Lock()
+
+    def _budget(self, index, endpoint):
+        key = (index, endpoint)
+        if key not in self._budgets:
+            self._budgets[key] = {
+                "limit": None, "remaining": None, "reset_at": 0.0,
+                "next_at": 0.0, "last_used": 0.0, "requests": 0, "rate_limited": 0, "observed_at": 0.0,
+            }
+        return self._budgets[key]
+
+    def _plan(self, budget, now):
+        """Return (start, interval, headroom) for the next request on a budget"""
+        if budget["reset_at"] and budget["reset_at"] <= now:
+            # Window rolled over: the full limit is available again
+            budget["remaining"] = budget["limit"]
+            budget["reset_at"] = 0.0
+            budget["next_at"] = 0.0
+        if budget["remaining"] is None:
+            # Never seen headers for this endpoint yet
+            return max(now, budget["next_at"]), 0.0, float("inf")
+        if budget["remaining"] <= 0:
+            return max(now, budget["reset_at"]), 0.0, 0.0
+        window = max(budget["reset_at"] - now, 1.0)
+        remaining = budget["remaining"] * self.share
+        return max(now, budget["next_at"]), window / remaining, remaining / window
+
+    def reserve(self, endpoint, max_wait=TOKEN_MAX_WAIT, exclude=()):
+        """Reserve the next slot on the token with the most headroom.
+
+        Returns (token_index, delay) where the caller should wait delay
+        seconds before sending, or (None, delay) if no token frees up
+        within max_wait. Tokens in `exclude` are not considered.
+        """
+        with self._lock:
+            now = time.time()
+            best = None
+            for index in range(self.token_count):
+                if index in exclude:
+                    continue
+                budget = self._budget(index, endpoint)
+                start, interval, headroom = self._plan(budget, now)
+                start = max(start, self.breakers[index].open_until)
+                key = (start, -headroom, budget["last_used"])
+                if best is None or key < best[0]:
+                    best = (key, index, start, interval)
+            if best is None:
+                return None, 0.0
+
+            _, index, start, interval = best
+            delay = start - now
+            if delay > max_wait:
+                return None, delay
+
+            self.breakers[index].probe(start)
+            budget = self._budget(index, endpoint)
+            budget["next_at"] = start + interval
+            budget["last_used"] = now
+            budget["requests"] += 1
+            if budget["remaining"] is not None:
+                # Already 0 when the slot is just after the reset; the refill covers it
+                budget["remaining"] = max(budget["remaining"] - 1, 0)
+            return index, delay
+
+    def record(self, index, endpoint, response):
+        """Update a token's budget from the headers of an X response"""
+        headers = response.headers
+        with self._lock:
+            budget = self._budget(index, endpoint)
+            try:
+                if "x-rate-limit-limit" in headers:
+                    budget["limit"] = int(headers["x-rate-limit-limit"])
+                if "x-rate-limit-remaining" in headers:
+                    budget["remaining"] = int(headers["x-rate-limit-remaining"])
+                if "x-rate-limit-reset" in headers:
+                    budget["reset_at"] = float(headers["x-rate-limit-reset"])
+                    budget["observed_at"] = time.time()
+            except ValueError:
+                pass
+            if response.status_code >= 500 or response.status_code in (401, 403):
+                self.breakers[index].failure(time.time())
+            elif response.status_code != 429:
+                self.breakers[index].success()
+            if response.status_code == 429:
+                budget["rate_limited"] += 1
+                X_RATE_LIMITED.inc(token=index + 1, endpoint=endpoint)
+                budget["remaining"] = 0
+                if budget["reset_at"] <= time.time():
+                    # No usable reset header; fall back to one 15 minute window
+                    budget["reset_at"] = time.time() + 900
+                budget["observed_at"] = time.time()
+
+    def record_error(self, index):
+        """A request on this token failed without a response"""
+        with self._lock:
+            self.breakers[index].failure(time.time())
+
+    def wait_time(self, endpoint):
+        """Seconds until any token can send on this endpoint"""
+        with self._lock:
+            now = time.time()
+            starts = [
+                max(self._plan(self._budget(i, endpoint), now)[0], self.breakers[i].open_until)
+                for i in range(self.token_count)
+            ]
+        return max(0.0, min(starts) - now) if starts else 0.0
+
+    def capacity(self, endpoint, default_limit, window=900):
+        """Sustainable requests per second on an endpoint across all tokens"""
+        with self._lock:
+            total = 0.0
+            for index in range(self.token_count):
+                budget = self._budgets.get((index, endpoint))
+                limit = budget["limit"] if budget and budget["limit"] else default_limit
+                total += limit / window
+        return total * self.share
+
+    def observations(self, since):
+        """[(token_index, endpoint, limit, remaining, reset_at, observed_at)] seen after `since`"""
+        with self._lock:
+            return [
+                (index, endpoint, b["limit"], b["remaining"], b["reset_at"], b["observed_at"])
+                for (index, endpoint), b in self._budgets.items() if b["observed_at"] > since
+            ]
+
+    def merge(self, index, endpoint, limit, remaining, reset_at, observed_at):
+        """Adopt another worker's view of a budget if it is newer than ours"""
+        with self._lock:
+            budget = self._budget(index, endpoint)
+            if observed_at > budget["observed_at"]:
+                budget.update(limit=limit, remaining=remaining, reset_at=reset_at, observed_at=observed_at)
+
+    def snapshot(self):
+        """Copy of every known budget keyed by (token_index, endpoint)"""
+        with self._lock:
+            return {key: dict(budget) for key, budget in self._budgets.items()}
+
+    def open_circuits(self):
+        """{token_index: seconds until its next probe} for tokens taken out of rotation"""
+        with self._lock:
+            now = time.time()
+            return {
+                index: max(breaker.open_until - now, 0.0)
+                for index, breaker in enumerate(self.breakers) if breaker.tripped
+            }
+
+token_scheduler = TokenScheduler(len(X_BEARER_TOKENS))
+
+async def x_request(endpoint, path, params=None):
+    """GET an X endpoint on the best available token, moving to another
+    token on 429 or 5xx. Returns the response, or None if every token is spent."""
     if not X_BEARER_TOKENS:
         print("No X Bearer tokens configured!")
         return None
-        
-    current_time = time.time()
-    
-    # Try all tokens starting from current index
-    for i in range(len(X_BEARER_TOKENS)):
-        token_idx = (current_token_index + i) % len(X_BEARER_TOKENS)
-        token_info = token_rate_limits.get(token_idx, {'last_rate_limit': 0, 'wait_time': 0})
-        
-        # Check if this token is still rate limited
-        if token_info['last_rate_limit'] == 0 or (current_time - token_info['last_rate_limit']) > token_info['wait_time']:
-            current_token_index = token_idx
-            return X_BEARER_TOKENS[token_idx]
-    
-    # All tokens are rate limited, return the one with the shortest remaining wait
-    best_token_idx = 0
-    shortest_wait = float('inf')
-    
-    for i, token in enumerate(X_BEARER_TOKENS):
-        token_info = token_rate_limits.get(i, {'last_rate_limit': 0, 'wait_time': 0})
-        remaining_wait = token_info['wait_time'] - (current_time - token_info['last_rate_limit'])
-        if remaining_wait < shortest_wait:
-            shortest_wait = remaining_wait
-            best_token_idx = i
-    
-    current_token_index = best_token_idx
-    return X_BEARER_TOKENS[best_token_idx]
 
-def get_user_id_from_username(username: str):
-    token = get_next_available_token()
-    if not token:
-        return None
-        
-    url = f"https://api.twitter.com/2/users/by/username/{username}"
-    headers = {"Authorization": f"Bearer {token}"}
+    server_error = None
+    for _ in range(len(X_BEARER_TOKENS)):
+        index, delay = token_scheduler.reserve(endpoint)
+        if index is None:
+            print(f"All X tokens are rate limited for {endpoint}. Next slot in {int(delay)}s.")
+            return server_error
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        index, response = await hedged_x_get(index, endpoint, path, params)
+        if response.status_code >= 500:
+            # Counted against this token's circuit breaker; another token may get through
+            print(f"X API error {response.status_code} on token {index + 1} for {endpoint}. Trying next token...")
+            server_error = response
+            continue
+        if response.status_code != 429:
+            return response
+        print(f"Rate limited on token {index + 1} for {endpoint}. Trying next token...")
+    return server_error
+
+# Recent X latencies per endpoint, for the hedging delay
+x_latencies: Dict[str, deque] = {}
+
+def hedge_delay(endpoint) -> float:
+    """How long to wait for an answer before hedging: the HEDGE_PERCENTILE latency"""
+    recent = x_latencies.get(endpoint)
+    if not recent or len(recent) < 20:
+        # Not enough history yet: only hedge requests that are clearly stuck
+        return max(HTTP_TIMEOUT / 4, HEDGE_MIN_DELAY)
+    return max(percentile(sorted(recent), HEDGE_PERCENTILE), HEDGE_MIN_DELAY)
+
+async def send_x_get(index, endpoint, path, params):
+    """One GET on one token, recorded in the metrics, its budget and its breaker"""
+    started = time.monotonic()
     try:
-        response = requests.get(url, headers=headers).json()
-        if "data" in response:
-            return response["data"]["id"]
-        else:
-            print(f"Error getting user ID: {response}")
-    except Exception as e:
-        print(f"Error in get_user_id_from_username: {e}")
-    return None
+        response = await x_api_get(path, X_BEARER_TOKENS[index], params)
+    except httpx.HTTPError:
+        X_REQUESTS.inc(token=index + 1, endpoint=endpoint, status="error")
+        token_scheduler.record_error(index)
+        raise
+    elapsed = time.monotonic() - started
+    X_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    X_REQUESTS.inc(token=index + 1, endpoint=endpoint, status=response.status_code)
+    x_latencies.setdefault(endpoint, deque(maxlen=200)).append(elapsed)
+    token_scheduler.record(index, endpoint, response)
+    return index, response
 
-def get_latest_tweet(user_id):
-    global last_rate_limit_time, current_wait_time, current_token_index
-    
-    token = get_next_available_token()
-    if not token:
-        print("No available X tokens!")
-        return None, []
-    
-    url = (
-        f"https://api.twitter.com/2/users/{user_id}/tweets"
-        f"?max_results=5&expansions=attachments.media_keys"
-        f"&media.fields=preview_image_url,url"
+def usable_answer(task) -> bool:
+    return task.exception() is None and task.result()[1].status_code < 500 and task.result()[1].status_code != 429
+
+async def hedged_x_get(index, endpoint, path, params):
+    """GET on token `index`; if it is slow, race a duplicate on another token.
+
+    Returns (token_index, response) of the first usable answer and cancels
+    the other request. The hedge only goes to a token with a free slot
+    right now, so it never waits on or oversteps a rate limit.
+    """
+    primary = asyncio.create_task(send_x_get(index, endpoint, path, params))
+    tasks = [primary]
+    try:
+        if not HEDGE_REQUESTS or len(X_BEARER_TOKENS) < 2:
+            return await primary
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay(endpoint))
+        if done:
+            return primary.result()
+        hedge_index, _ = token_scheduler.reserve(endpoint, max_wait=0, exclude={index})
+        if hedge_index is None:
+            return await primary
+
+        tasks.append(asyncio.create_task(send_x_get(hedge_index, endpoint, path, params)))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if usable_answer(task):
+                    X_HEDGED.inc(endpoint=endpoint, winner="primary" if task is primary else "hedge")
+                    return task.result()
+        # Neither answer was usable: report the primary's unless only the hedge got one
+        X_HEDGED.inc(endpoint=endpoint, winner="none")
+        hedge = tasks[1]
+        if primary.exception() is not None and hedge.exception() is None:
+            return hedge.result()
+        return primary.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+# /2/users/by and /2/users accept at most this many names or IDs per call
+USER_LOOKUP_BATCH = 100
+
+async def lookup_users(endpoint, path, param, values):
+    """Batched user lookup; returns [(user_id, username)] for everything found"""
+    users = []
+    for start in range(0, len(values), USER_LOOKUP_BATCH):
+        chunk = values[start:start + USER_LOOKUP_BATCH]
+        try:
+            response = await x_request(endpoint, path, {param: ",".join(chunk)})
+            if response is None:
+                continue
+            response_json = json_loads(response.content)
+            if response.status_code != 200:
+                print(f"X API error {response.status_code}: {response_json}")
+                continue
+            users.extend((u["id"], u["username"]) for u in response_json.get("data", []))
+        except Exception as e:
+            print(f"Error looking up users: {e}")
+    return users
+
+async def resolve_usernames(usernames):
+    """Map usernames to (user_id, canonical username), keyed by lowercase name.
+
+    Fresh answers come from the persistent cache; the rest are looked up
+    100 at a time. Names X doesn't know are left out.
+    """
+    names = list(dict.fromkeys(u.replace("@", "").lower() for u in usernames if u))
+    resolved = store.cached_users(names, time.time() - USERNAME_CACHE_TTL)
+    missing = [name for name in names if name not in resolved]
+    if missing:
+        users = await lookup_users("users_by", "/2/users/by", "usernames", missing)
+        store.cache_users(users)
+        for user_id, username in users:
+            resolved[username.lower()] = (user_id, username)
+    return resolved
+
+async def get_user_id_from_username(username: str):
+    user = (await resolve_usernames([username])).get(username.replace("@", "").lower())
+    return user[0] if user else None
+
+async def revalidate_usernames():
+    """Re-check watched accounts whose cached handle expired, picking up renames.
+
+    Returns how many accounts were renamed.
+    """
+    user_ids = [a["x_user_id"] for a in config["accounts"] if owns_account(a["x_user_id"])]
+    stale = store.stale_user_ids(user_ids, time.time() - USERNAME_CACHE_TTL)
+    if not stale:
+        return 0
+    users = await lookup_users("users", "/2/users", "ids", stale)
+    store.cache_users(users)
+
+    renamed = 0
+    async with state_lock:
+        for user_id, username in users:
+            account = find_account(user_id)
+            if account and account["x_username"] != username:
+                print(f"@{account['x_username']} is now @{username}")
+                account["x_username"] = username
+                store.rename_account(user_id, username)
+                renamed += 1
+    return renamed
+
+async def fetch_user_tweets(user_id, params):
+    """GET /2/users/{id}/tweets with token rotation; returns the parsed JSON or None"""
+    response = await x_request("users_tweets", f"/2/users/{user_id}/tweets", params)
+    if response is None:
+        return None
+
+    response_json = json_loads(response.content)
+    if response.status_code != 200:
+        print(f"X API error {response.status_code}: {response_json}")
+        return None
+    return response_json
+
+# Request only what delivery reads: id and text always come back, and a
+# tweet's creation time is in its snowflake ID, so no created_at
+TWEET_PARAMS = {
+    "expansions": "attachments.media_keys",
+    "media.fields": "type,url,preview_image_url,variants,duration_ms",
+}
+# Search and the stream mix authors, so they need author_id as well
+AUTHORED_TWEET_PARAMS = {**TWEET_PARAMS, "tweet.fields": "author_id"}
+
+class Media:
+    """A photo, video or animation as Telegram sends it.
+
+    preview is a video's still frame, sent instead if Telegram refuses the video.
+    """
+    __slots__ = ("type", "url", "preview")
+
+    def __init__(self, type: str, url: str, preview: Optional[str] = None):
+        self.type = type
+        self.url = url
+        self.preview = preview
+
+    def __repr__(self):
+        return f"Media({self.type!r}, {self.url!r})"
+
+class Tweet:
+    """The parts of a v2 tweet the bot renders, with its media already joined"""
+    __slots__ = ("id", "text", "author_id", "media")
+
+    def __init__(self, id: str, text: str, author_id: Optional[str] = None, media: Optional[List[Media]] = None):
+        self.id = id
+        self.text = text
+        self.author_id = author_id
+        self.media = media or []
+
+    def __repr__(self):
+        return f"Tweet({self.id!r}, author_id={self.author_id!r}, media={self.media!r})"
+
+    @property
+    def created_at(self) -> float:
+        return snowflake_time(self.id)
+
+# Telegram only fetches files up to 20 MB from a URL
+TELEGRAM_URL_MAX_BYTES = 20 * 1024 * 1024
+
+def pick_video_variant(media):
+    """Highest bit-rate MP4 of a video/GIF that Telegram can fetch, if any.
+
+    Sizes are estimated from bit rate and duration, with a tenth kept as
+    headroom for the container; without a duration the lowest bit rate
+    is the safe choice.
+    """
+    mp4s = sorted(
+        (v for v in media.get("variants", []) if v.get("content_type") == "video/mp4" and v.get("url")),
+        key=lambda v: v.get("bit_rate", 0),
     )
-    headers = {"Authorization": f"Bearer {token}"}
+    if not mp4s:
+        return None
+    duration_ms = media.get("duration_ms")
+    if duration_ms:
+        fitting = [v for v in mp4s if v.get("bit_rate", 0) * duration_ms / 8000 <= TELEGRAM_URL_MAX_BYTES * 0.9]
+        if fitting:
+            return fitting[-1]["url"]
+    return mp4s[0]["url"]
+
+def parse_media(m) -> Optional[Media]:
+    """The Media to send for one includes.media entry, or None if nothing is sendable"""
+    if m.get("type") in ("video", "animated_gif"):
+        video_url = pick_video_variant(m)
+        if video_url:
+            return Media("video" if m["type"] == "video" else "animation", video_url, m.get("preview_image_url"))
+        if "preview_image_url" in m:
+            # No playable variant exposed, fall back to the still frame
+            return Media("photo", m["preview_image_url"])
+    elif "url" in m:
+        return Media("photo", m["url"])
+    return None
+
+def media_index(response_json) -> Dict[str, Media]:
+    """includes.media of a response keyed by media_key, for joining onto its tweets"""
+    index = {}
+    for m in response_json.get("includes", {}).get("media", ()):
+        item = parse_media(m)
+        if item and "media_key" in m:
+            index[m["media_key"]] = item
+    return index
+
+def parse_tweet(data, index: Dict[str, Media]) -> Tweet:
+    # ONLY attach media that belongs specifically to THIS tweet, in its own order
+    media_keys = data.get("attachments", {}).get("media_keys", ())
+    media = [index[key] for key in media_keys if key in index]
+    return Tweet(data["id"], data.get("text", ""), data.get("author_id"), media)
+
+def parse_tweets(response_json) -> List[Tweet]:
+    """The tweets of a v2 response, in response order"""
+    data = response_json.get("data")
+    if not data:
+        return []
+    index = media_index(response_json)
+    return [parse_tweet(t, index) for t in data]
+
+async def get_latest_tweet(user_id) -> Optional[Tweet]:
+    params = {"max_results": 5, **TWEET_PARAMS}
     try:
-        response = requests.get(url, headers=headers)
-        response_json = response.json()
-        
-        if response.status_code == 429:
-            # Mark current token as rate limited
-            current_time = time.time()
-            token_rate_limits[current_token_index] = {
-                'last_rate_limit': current_time,
-                'wait_time': 900  # 15 minutes
-            }
-            print(f"Rate limited on token {current_token_index + 1}. Trying next token...")
-            
-            # Try the next token
-            next_token = get_next_available_token()
-            if next_token and next_token != token:
-                print(f"Switched to token {current_token_index + 1}")
-                return get_latest_tweet(user_id)  # Recursive call with new token
-            else:
-                last_rate_limit_time = current_time
-                current_wait_time = 900
-                print("All tokens are rate limited. Will wait before next request.")
-                return None, []
-        elif response.status_code != 200:
-            print(f"X API error {response.status_code}: {response_json}")
-            return None, []
+        response_json = await fetch_user_tweets(user_id, params)
+        if response_json is None:
+            return None
         elif "data" in response_json:
-            # Reset rate limit tracking on successful request
-            last_rate_limit_time = 0
-            current_wait_time = 0
-            
             # Always return only the most recent tweet (first in the list)
-            latest_tweet = response_json["data"][0]
-            media_urls = []
-            
-            # ONLY get media that belongs specifically to THIS tweet
-            if "attachments" in latest_tweet and "media_keys" in latest_tweet["attachments"]:
-                current_tweet_media_keys = latest_tweet["attachments"]["media_keys"]
-                
-                if "includes" in response_json and "media" in response_json["includes"]:
-                    for m in response_json["includes"]["media"]:
-                        # Only include media that belongs to the current tweet
-                        if m.get("media_key") in current_tweet_media_keys and "url" in m:
-                            media_urls.append(m["url"])
-            
-            return latest_tweet, media_urls
+            return parse_tweets(response_json)[0]
         else:
             print(f"No tweet data: {response_json}")
-            return None, []
+            return None
     except Exception as e:
         print(f"Error in get_latest_tweet: {e}")
-        return None, []
+        return None
 
-# --- Telegram posting ---
-def post_text(chat_id, text):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    data = {"chat_id": chat_id, "text": text, "disable_web_page_preview": False}
+async def get_new_tweets(user_id, since_id) -> Optional[List[Tweet]]:
+    """Fetch every tweet newer than since_id, paging until caught up.
+
+    Returns the tweets oldest-first, or None if a page could not be
+    fetched (the caller keeps its cursor and retries later).
+    """
+    params = {"max_results": 100, "since_id": since_id, **TWEET_PARAMS}
+    new_tweets = []
     try:
-        response = requests.post(url, data=data)
-        if not response.ok:
-            print(f"Error posting text: {response.text}")
+        for _ in range(MAX_CATCHUP_PAGES):
+            response_json = await fetch_user_tweets(user_id, params)
+            if response_json is None:
+                return None
+            new_tweets.extend(parse_tweets(response_json))
+
+            next_token = response_json.get("meta", {}).get("next_token")
+            if not next_token:
+                break
+            params["pagination_token"] = next_token
+        else:
+            print(f"Catch-up for user {user_id} stopped after {MAX_CATCHUP_PAGES} pages")
     except Exception as e:
-        print(f"Error in post_text: {e}")
+        print(f"Error in get_new_tweets: {e}")
+        return None
+
+    # X returns newest first; deliver in the order they were posted
+    new_tweets.reverse()
+    return new_tweets
+
+def pack_search_queries(usernames, max_len=SEARCH_QUERY_MAX_LEN):
+    """Bin-pack usernames into "from:a OR from:b ..." queries under max_len.
+
+    First-fit decreasing: longest handles are placed first, each into the
+    first query with room left, which keeps the number of queries close
+    to the minimum.
+    """
+    bins = []  # [query length, usernames]
+    for username in sorted(usernames, key=len, reverse=True):
+        term_len = len("from:") + len(username)
+        for entry in bins:
+            if entry[0] + len(" OR ") + term_len <= max_len:
+                entry[0] += len(" OR ") + term_len
+                entry[1].append(username)
+                break
+        else:
+            bins.append([term_len, [username]])
+    return [names for _, names in bins]
+
+# Recent search only reaches back 7 days; keep a little margin
+SEARCH_WINDOW = 7 * 24 * 3600 - 300
+
+# Newest tweet ID a packed search has covered for each account. A cursor
+# only moves when its account posts, so without this one quiet account
+# would drag its whole query back to its last tweet on every poll
+searched_through: Dict[str, str] = {}
+
+def search_since(account: AccountState) -> str:
+    """Tweet ID an account's tweets have been searched up to"""
+    mark = searched_through.get(account["x_user_id"])
+    cursor = account["last_tweet_id"]
+    return mark if mark is not None and snowflake(mark) > snowflake(cursor) else cursor
+
+async def search_new_tweets(accounts: List[AccountState]):
+    """Fetch new tweets for many accounts with one packed recent-search query.
+
+    Returns (by_author, newest_id, requests): {user_id: [tweet, ...]
+    oldest-first} with only tweets newer than what each account was
+    searched up to, or None if a page failed; the newest tweet ID the
+    query covered; and the number of pages it took.
+    """
+    query = " OR ".join(f"from:{a['x_username']}" for a in accounts)
+    params = {"query": query, "max_results": 100, **AUTHORED_TWEET_PARAMS}
+    # One since_id for the batch: the oldest position, so nobody misses tweets
+    since = {a["x_user_id"]: snowflake(search_since(a)) for a in accounts}
+    since_id = str(min(since.values()))
+    if snowflake_time(since_id) > time.time() - SEARCH_WINDOW:
+        params["since_id"] = since_id
+    else:
+        params["start_time"] = datetime.fromtimestamp(time.time() - SEARCH_WINDOW, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
-def post_photo(chat_id, photo_url, caption=""):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendPhoto"
-    data = {"chat_id": chat_id, "photo": photo_url, "caption": caption}
+    by_author: Dict[str, List[Tweet]] = {user_id: [] for user_id in since}
+    newest_id = None
+    requests = 0
     try:
-        response = requests.post(url, data=data)
-        if not response.ok:
-            print(f"Error posting photo: {response.text}")
+        for _ in range(MAX_CATCHUP_PAGES):
+            requests += 1
+            response = await x_request("search_recent", "/2/tweets/search/recent", params)
+            if response is None:
+                return None, None, requests
+            response_json = json_loads(response.content)
+            if response.status_code != 200:
+                print(f"X API error {response.status_code}: {response_json}")
+                return None, None, requests
+            for tweet in parse_tweets(response_json):
+                if tweet.author_id in since and snowflake(tweet.id) > since[tweet.author_id]:
+                    by_author[tweet.author_id].append(tweet)
+
+            meta = response_json.get("meta", {})
+            # The first page holds the newest results
+            newest_id = newest_id or meta.get("newest_id")
+            next_token = meta.get("next_token")
+            if not next_token:
+                break
+            params["next_token"] = next_token
+        else:
+            print(f"Search catch-up stopped after {MAX_CATCHUP_PAGES} pages")
     except Exception as e:
-        print(f"Error in post_photo: {e}")
+        print(f"Error in search_new_tweets: {e}")
+        return None, None, requests
+
+    # Search returns newest first; deliver in the order they were posted
+    for tweets in by_author.values():
+        tweets.reverse()
+    return by_author, newest_id, requests
+
+# --- Telegram posting ---
+@dataclass
+class OutboundMessage:
+    chat_id: str
+    method: str
+    data: Dict[str, Any]
+    future: "asyncio.Future[Optional[Dict[str, Any]]]"
+    attempts: int = 0
+    # Row in the durable outbox, None for messages that aren't persisted
+    outbox_id: Optional[int] = None
+    # Telegram refused the message outright; retrying won't help
+    rejected: Optional[str] = None
+    # Resolved once the message is delivered or given up on, outbox retries
+    # included; `future` only reports the first attempt
+    outcome: "Optional[asyncio.Future[Optional[Dict[str, Any]]]]" = None
+
+class RateLimiter:
+    """Token bucket allowing `rate` sends per second with bursts up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        """Hold every send until `seconds` from now (Telegram's retry_after)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class DeliveryQueue:
+    """Outbound Telegram queue drained by a pool of workers.
+
+    Messages for one chat are sent strictly in the order they were queued,
+    while different chats are served round-robin. Sends are limited by a
+    global and a per-chat token bucket, 429s are retried after Telegram's
+    retry_after, and submit() blocks once `capacity` messages are pending
+    so a backlog slows polling down instead of growing without bound.
+
+    Outbox messages are only sent once their row is committed, and are
+    acked after Telegram confirms them. One that keeps failing stays in
+    the outbox and is queued again after OUTBOX_RETRY_DELAY.
+    """
+
+    def __init__(self, workers, capacity):
+        self.workers = workers
+        self.global_limiter = RateLimiter(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        self.chat_limiters: Dict[str, RateLimiter] = {}
+        self.pending: Dict[str, deque] = {}
+        self.ready: "asyncio.Queue[str]" = asyncio.Queue()
+        self.slots = asyncio.Semaphore(capacity)
+        self.depth = 0
+        self.tasks = []
+        self._retries = set()
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def submit(self, chat_id, method, data, outbox_id=None, outcome=None):
+        """Queue one Bot API call; returns a future resolved with its result.
+
+        `outcome`, if given, is resolved with the final result instead,
+        after any retries from the outbox.
+        """
+        await self.slots.acquire()
+        message = OutboundMessage(
+            str(chat_id), method, data, asyncio.get_running_loop().create_future(), outbox_id=outbox_id, outcome=outcome
+        )
+        self.depth += 1
+        if message.chat_id in self.pending:
+            self.pending[message.chat_id].append(message)
+        else:
+            self.pending[message.chat_id] = deque([message])
+            self.ready.put_nowait(message.chat_id)
+        return message.future
+
+    def _chat_limiter(self, chat_id):
+        if chat_id not in self.chat_limiters:
+            self.chat_limiters[chat_id] = RateLimiter(TELEGRAM_CHAT_RATE / 60, TELEGRAM_CHAT_BURST)
+        return self.chat_limiters[chat_id]
+
+    async def _worker(self):
+        while True:
+            chat_id = await self.ready.get()
+            queue = self.pending[chat_id]
+            message = queue.popleft()
+            try:
+                result = await self._send(message)
+            except Exception as e:
+                print(f"Error in delivery worker: {e}")
+                result = None
+            retrying = message.outbox_id is not None and self._settle(message, result)
+            if not message.future.done():
+                message.future.set_result(result)
+            if message.outcome and not retrying and not message.outcome.done():
+                message.outcome.set_result(result)
+            self.depth -= 1
+            self.slots.release()
+
+            if queue:
+                # Go to the back of the line so one busy chat can't starve the rest
+                self.ready.put_nowait(chat_id)
+            else:
+                del self.pending[chat_id]
+
+    def _settle(self, message, result) -> bool:
+        """Ack, fail or requeue an outbox message after a send; True if it will be retried"""
+        if result:
+            store.ack_outbox(message.outbox_id)
+            # Commit the ack promptly: until then a crash would send it again
+            flush_requested.set()
+        elif message.rejected:
+            store.fail_outbox(message.outbox_id, message.rejected)
+        else:
+            print(f"Keeping {message.method} to {message.chat_id} in the outbox, retrying in {int(OUTBOX_RETRY_DELAY)}s")
+            task = asyncio.create_task(self._resubmit(message))
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+            return True
+        return False
+
+    async def _resubmit(self, message):
+        await asyncio.sleep(OUTBOX_RETRY_DELAY)
+        # The retry settles the same outcome, so metrics and traces follow it
+        await self.submit(message.chat_id, message.method, message.data, message.outbox_id, message.outcome)
+
+    async def _send(self, message):
+        if message.outbox_id is not None:
+            await wait_for_commit(message.outbox_id)
+        method, original = message.method, message.data
+        # Send cached file_ids where we have them, the stored URLs otherwise
+        data = media_cache.apply(method, original)
+        chat_limiter = self._chat_limiter(message.chat_id)
+        while message.attempts < DELIVERY_MAX_ATTEMPTS:
+            await chat_limiter.acquire()
+            await self.global_limiter.acquire()
+            started = time.monotonic()
+            try:
+                response = await telegram_api(method, {k: v for k, v in data.items() if k != FALLBACK_FIELD})
+                TELEGRAM_REQUEST_SECONDS.observe(time.monotonic() - started, method=method)
+                TELEGRAM_REQUESTS.inc(method=method, status=response.status_code)
+                result = response.json()
+            except Exception as e:
+                if isinstance(e, httpx.HTTPError):
+                    TELEGRAM_REQUESTS.inc(method=method, status="error")
+                message.attempts += 1
+                print(f"Error in {method} to {message.chat_id}: {e}")
+                await asyncio.sleep(min(2 ** message.attempts, 60))
+                continue
+
+            if result.get("ok"):
+                media_cache.remember(method, original, result)
+                return result
+            if response.status_code == 429:
+                # Flood control: wait as long as Telegram asks, doesn't count as a failure
+                retry_after = result.get("parameters", {}).get("retry_after", 1)
+                print(f"Telegram rate limited {message.chat_id}. Retrying in {retry_after}s...")
+                chat_limiter.pause(retry_after)
+                continue
+            if response.status_code >= 500:
+                message.attempts += 1
+                await asyncio.sleep(min(2 ** message.attempts, 60))
+                continue
+            if data is not original:
+                # A cached file_id may have gone stale: let Telegram fetch the URLs
+                print(f"Telegram rejected {method} to {message.chat_id} ({response.text}), retrying with media URLs")
+                data = original
+                continue
+            if FALLBACK_FIELD in original:
+                # E.g. a video too big for Telegram to fetch: post its still frame or the text instead
+                print(f"Telegram rejected {method} to {message.chat_id} ({response.text}), sending the fallback")
+                method, original = original[FALLBACK_FIELD]
+                data = media_cache.apply(method, original)
+                continue
+            print(f"Error posting {method} to {message.chat_id}: {response.text}")
+            message.rejected = result.get("description") or response.text
+            return None
+
+        print(f"Giving up on {method} to {message.chat_id} after {message.attempts} attempts")
+        return None
+
+# Created on the running event loop by start_engine()
+delivery_queue: Optional[DeliveryQueue] = None
+
+def text_message(chat_id, text):
+    return "sendMessage", {"chat_id": chat_id, "text": text, "disable_web_page_preview": False}
+
+async def post_text(chat_id, text):
+    return await delivery_queue.submit(chat_id, *text_message(chat_id, text))
+
+# Bot API method and field used to send a single item of each media type
+MEDIA_SEND_METHODS = {
+    "photo": ("sendPhoto", "photo"),
+    "video": ("sendVideo", "video"),
+    "animation": ("sendAnimation", "animation"),
+}
+MEDIA_METHOD_FIELDS = {method: field for method, field in MEDIA_SEND_METHODS.values()}
+# Telegram caps media captions well below the 4096 characters of a text message
+CAPTION_LIMIT = 1024
+MEDIA_GROUP_LIMIT = 10
+
+# What to send instead when Telegram refuses a media message, e.g. a video
+# it can't fetch: (method, data), stored in the message data so it
+# survives in the outbox, and stripped before the message is sent
+FALLBACK_FIELD = "_fallback"
+
+def with_fallback(message, fallback):
+    method, data = message
+    return (method, {**data, FALLBACK_FIELD: fallback}) if fallback else message
+
+def still_frames(items: List[Media]) -> List[Media]:
+    """Photos as they are and videos as their preview frames, dropping videos without one"""
+    return [item if item.type == "photo" else Media("photo", item.preview) for item in items if item.type == "photo" or item.preview]
+
+def media_message(chat_id, item: Media, caption=""):
+    method, field = MEDIA_SEND_METHODS[item.type]
+    if item.type != "photo" and item.preview:
+        fallback = media_message(chat_id, Media("photo", item.preview), caption)
+    else:
+        # Nothing else to show: keep at least the tweet text
+        fallback = text_message(chat_id, caption) if caption else None
+    return with_fallback((method, {"chat_id": chat_id, field: item.url, "caption": caption}), fallback)
+
+def media_group_message(chat_id, items: List[Media], caption=""):
+    """Up to 10 items as one album, captioned on the first item"""
+    media = []
+    for item in items:
+        # GIFs can't go in an album as animations, Telegram plays them as videos
+        entry = {"type": "photo" if item.type == "photo" else "video", "media": item.url}
+        if not media and caption:
+            entry["caption"] = caption
+        media.append(entry)
+    # With videos in it, try the album again as still frames; then just the text
+    frames = still_frames(items) if any(item.type != "photo" for item in items) else []
+    if len(frames) > 1:
+        fallback = media_group_message(chat_id, frames, caption)
+    elif frames:
+        fallback = media_message(chat_id, frames[0], caption)
+    else:
+        fallback = text_message(chat_id, caption) if caption else None
+    return with_fallback(("sendMediaGroup", {"chat_id": chat_id, "media": json.dumps(media)}), fallback)
+
+class MediaCache:
+    """LRU of media URL -> Telegram file_id.
+
+    Once Telegram has fetched a photo or video it returns a file_id that
+    any chat can be sent instead of the URL, so reposts and extra
+    channels don't make Telegram download the file from X again. Keys
+    include the send type, as a file_id only works for the kind it was
+    uploaded as.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._files: OrderedDict = OrderedDict()
+
+    def get(self, kind, url) -> Optional[str]:
+        file_id = self._files.get(f"{kind}:{url}")
+        if file_id is not None:
+            self._files.move_to_end(f"{kind}:{url}")
+        return file_id
+
+    def put(self, media_key, file_id, persist=True):
+        if self._files.get(media_key) == file_id:
+            self._files.move_to_end(media_key)
+            return
+        self._files[media_key] = file_id
+        self._files.move_to_end(media_key)
+        if len(self._files) > self.capacity:
+            self._files.popitem(last=False)
+        if persist:
+            store.record_media(media_key, file_id)
+
+    def _entries(self, method, data):
+        """The (kind, url) media items a Bot API call sends"""
+        if method == "sendMediaGroup":
+            return [(entry["type"], entry["media"]) for entry in json.loads(data["media"])]
+        if method in MEDIA_METHOD_FIELDS:
+            return [(MEDIA_METHOD_FIELDS[method], data[MEDIA_METHOD_FIELDS[method]])]
+        return []
+
+    def apply(self, method, data):
+        """`data` with media URLs swapped for cached file_ids; `data` itself if none are cached"""
+        if method == "sendMediaGroup":
+            media = json.loads(data["media"])
+            cached = [{**entry, "media": self.get(entry["type"], entry["media"]) or entry["media"]} for entry in media]
+            return data if cached == media else {**data, "media": json.dumps(cached)}
+        if method in MEDIA_METHOD_FIELDS:
+            field = MEDIA_METHOD_FIELDS[method]
+            file_id = self.get(field, data[field])
+            return {**data, field: file_id} if file_id else data
+        return data
+
+    def remember(self, method, data, result):
+        """Cache the file_ids Telegram returned for the media URLs in `data`"""
+        messages = result["result"] if isinstance(result["result"], list) else [result["result"]]
+        for (kind, url), message in zip(self._entries(method, data), messages):
+            if kind == "photo":
+                # Sizes come smallest first; the last one is the original
+                file_id = (message.get("photo") or [{}])[-1].get("file_id")
+            else:
+                file_id = (message.get(kind) or {}).get("file_id")
+            if file_id:
+                self.put(f"{kind}:{url}", file_id)
+
+media_cache = MediaCache(MEDIA_CACHE_CAPACITY)
+for cached_key, cached_file_id in store.recent_media(MEDIA_CACHE_CAPACITY):
+    media_cache.put(cached_key, cached_file_id, persist=False)
+
+# --- Latency tracing ---
+@dataclass
+class TweetTrace:
+    """When one tweet reached each stage on its way to one channel (unix times)"""
+    tweet_id: str
+    username: str
+    channel: str
+    created: float  # minted on X, from the snowflake ID
+    requested: float  # the poll that found it was sent (stream: received)
+    fetched: float  # that poll's response was in
+    queued: float = 0.0  # rendered and handed to the delivery queue
+    sent: float = 0.0  # Telegram confirmed the last message
+
+    def stages(self):
+        return {
+            # A tweet can't be found before it exists; clamp clock skew
+            "detect": max(self.requested - self.created, 0.0),
+            "fetch": self.fetched - self.requested,
+            "render": self.queued - self.fetched,
+            "send": self.sent - self.queued,
+            "total": max(self.sent - self.created, 0.0),
+        }
+
+class LatencyTracer:
+    """Ring buffer of delivered tweets' traces with percentile summaries.
+
+    Traces are completed by the delivery queue's futures on the event loop
+    and read by /latency on the Flask thread.
+    """
+
+    STAGES = ("detect", "fetch", "render", "send", "total")
+
+    def __init__(self, capacity):
+        self._traces: deque = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def start(self, tweet: Tweet, account: AccountState, fetch_times) -> Optional[TweetTrace]:
+        """A trace for a freshly fetched tweet, or None when fetch_times is unknown"""
+        if fetch_times is None:
+            return None
+        requested, fetched = fetch_times
+        return TweetTrace(tweet.id, account["x_username"], "", tweet.created_at, requested, fetched)
+
+    def track(self, trace: Optional[TweetTrace], channel, futures):
+        """Finish a copy of `trace` for `channel` once all of its sends succeed"""
+        if trace is None:
+            return
+        trace = TweetTrace(**{**trace.__dict__, "channel": str(channel), "queued": time.time()})
+        pending = set(futures)
+
+        def done(future):
+            pending.discard(future)
+            if pending or not all(not f.cancelled() and f.result() for f in futures):
+                return
+            trace.sent = time.time()
+            for stage, seconds in trace.stages().items():
+                TWEET_LATENCY_SECONDS.observe(seconds, stage=stage)
+            with self._lock:
+                self._traces.append(trace)
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    def recent(self, limit=None) -> List[TweetTrace]:
+        with self._lock:
+            traces = list(self._traces)
+        return traces[-limit:] if limit else traces
+
+    def summary(self):
+        """{stage: {"p50", "p95", "p99"}} over the buffered traces"""
+        traces = self.recent()
+        summary = {}
+        for stage in self.STAGES:
+            values = sorted(t.stages()[stage] for t in traces)
+            summary[stage] = {f"p{q}": percentile(values, q) for q in (50, 95, 99)}
+        return summary
+
+    def report(self, recent=20):
+        return {
+            "count": len(self.recent()),
+            "stages": self.summary(),
+            "recent": [{**t.__dict__, "stages": t.stages()} for t in self.recent(recent)],
+        }
+
+def percentile(sorted_values, q) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(q / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+latency_tracer = LatencyTracer(TRACE_CAPACITY)
+
+# --- Polling engine ---
+def format_tweet_message(tweet: Tweet, username):
+    text = tweet.text
+    # Remove t.co links from the tweet text
+    text = re.sub(r'https://t\.co/\w+', '', text).strip()
+    link = f"https://x.com/{username}/status/{tweet.id}"
+    account_link = f"https://x.com/{username}"
+    return text, f"{text}\n\n🔗: {link}\n\nFollow My Account: {account_link}"
+
+def render_tweet(channel, formatted_message, media: List[Media]):
+    """The Bot API calls [(method, data)] that post a tweet to one channel"""
+    if not media:
+        return [text_message(channel, formatted_message)]
+
+    # Too long for a caption: post the media bare and the text after it
+    caption = formatted_message if len(formatted_message) <= CAPTION_LIMIT else ""
+    if len(media) == 1:
+        messages = [media_message(channel, media[0], caption)]
+    else:
+        messages = []
+        for start in range(0, len(media), MEDIA_GROUP_LIMIT):
+            chunk = media[start:start + MEDIA_GROUP_LIMIT]
+            messages.append(media_group_message(channel, chunk, "" if start else caption))
+    if not caption:
+        messages.append(text_message(channel, formatted_message))
+    return messages
+
+async def submit_messages(messages):
+    """Queue one channel's staged outbox messages.
+
+    Returns (sends, outcomes): futures of each message's first attempt,
+    and of its final result once outbox retries are done.
+    """
+    loop = asyncio.get_running_loop()
+    sends, outcomes = [], []
+    for outbox_id, chat_id, method, data in messages:
+        outcomes.append(loop.create_future())
+        sends.append(await delivery_queue.submit(chat_id, method, data, outbox_id, outcomes[-1]))
+    count_delivery(outcomes)
+    return sends, outcomes
+
+def count_delivery(futures):
+    """Count a tweet as delivered to a channel once Telegram accepted all its messages"""
+    pending = set(futures)
+
+    def done(future):
+        pending.discard(future)
+        if not pending:
+            ok = all(not f.cancelled() and f.result() for f in futures)
+            (TWEETS_DELIVERED if ok else TWEETS_FAILED).inc()
+
+    for future in futures:
+        future.add_done_callback(done)
+
+# Each account's newest pending fan-out, so later tweets queue behind it
+fan_out_tails: Dict[str, "asyncio.Task[None]"] = {}
+
+async def fan_out_tweet(previous, first_sends, batches, has_media, trace):
+    """Send a tweet to the rest of its channels once the first send is done"""
+    try:
+        if has_media:
+            # By now the media cache holds the file_ids of the first upload
+            await asyncio.gather(*first_sends)
+        if previous:
+            await previous
+        for messages in batches:
+            _, outcomes = await submit_messages(messages)
+            latency_tracer.track(trace, messages[0][1], outcomes)
+    except Exception as e:
+        print(f"Error fanning out tweet: {e}")
+
+async def deliver_tweet(account: AccountState, batches, trace=None):
+    """Queue a tweet's staged messages, one batch per channel; returns the first channel's futures.
+
+    The first channel gets the tweet straight away. The others get it once
+    that upload has finished, by file_id, so Telegram fetches each photo
+    or video from X only once however many channels there are.
+    """
+    futures, outcomes = await submit_messages(batches[0])
+    latency_tracer.track(trace, batches[0][0][1], outcomes)
+    if len(batches) > 1:
+        user_id = account["x_user_id"]
+        has_media = any(method != "sendMessage" for _, _, method, _ in batches[0])
+        # Waits on the first attempt only: one channel's retries don't hold up the rest
+        task = asyncio.create_task(fan_out_tweet(fan_out_tails.get(user_id), futures, batches[1:], has_media, trace))
+        fan_out_tails[user_id] = task
+        task.add_done_callback(lambda t: fan_out_tails.pop(user_id) if fan_out_tails.get(user_id) is t else None)
+    return futures
+
+class PollScheduler:
+    """Priority queue deciding when each account is polled next.
+
+    Each account's posting rate is learned from its tweets' creation times.
+    Under a fixed request budget R, average detection latency is lowest
+    when an account with rate λ is polled at R·√λ / Σ√λ, so busy accounts
+    are polled often and quiet ones rarely. Runs on the poller loop only.
+    """
+
+    EWMA_ALPHA = 0.3
+
+    def __init__(self):
+        self.endpoint, self.default_limit = ("search_recent", X_SEARCH_LIMIT) if POLL_MODE == "search" else ("users_tweets", X_TIMELINE_LIMIT)
+        # API requests one account poll costs; below 1 when polls share a search query
+        self.requests_per_poll = 1.0
+        self._heap = []
+        self._seq = itertools.count()
+        self._accounts: Dict[str, Dict[str, Any]] = {}
+        self._weight_sum = 0.0
+
+    def sync(self, user_ids):
+        """Track exactly these accounts; new ones are due immediately"""
+        wanted = set(user_ids)
+        for user_id in list(self._accounts):
+            if user_id not in wanted:
+                self._weight_sum -= self._accounts.pop(user_id)["weight"]
+        now = time.time()
+        for user_id in user_ids:
+            if user_id not in self._accounts:
+                stats = {"interval_ewma": None, "last_tweet_at": None, "failures": 0,
+                         "weight": 0.0, "due": now, "seq": None}
+                self._accounts[user_id] = stats
+                self._update_weight(stats, now)
+                self._push(user_id, stats, now)
+
+    def observe(self, user_id, tweets: List[Tweet]):
+        """Learn from newly seen tweets' creation times (any order)"""
+        stats = self._accounts.get(user_id)
+        if stats is None:
+            return
+        for created in sorted(tweet.created_at for tweet in tweets):
+            if stats["last_tweet_at"] is not None and created > stats["last_tweet_at"]:
+                gap = created - stats["last_tweet_at"]
+                if stats["interval_ewma"] is None:
+                    stats["interval_ewma"] = gap
+                else:
+                    stats["interval_ewma"] += self.EWMA_ALPHA * (gap - stats["interval_ewma"])
+            if stats["last_tweet_at"] is None or created > stats["last_tweet_at"]:
+                stats["last_tweet_at"] = created
+
+    def _update_weight(self, stats, now):
+        # Silence counts as evidence too: an account quiet for a week
+        # can't be tweeting faster than once a week
+        interval = stats["interval_ewma"] or 86400 / PRIOR_TWEETS_PER_DAY
+        if stats["last_tweet_at"] is not None:
+            interval = max(interval, now - stats["last_tweet_at"])
+        weight = math.sqrt(1 / max(interval, 1.0))
+        self._weight_sum += weight - stats["weight"]
+        stats["weight"] = weight
+
+    def interval(self, user_id) -> float:
+        stats = self._accounts.get(user_id)
+        if stats is None or stats["weight"] <= 0:
+            return MAX_POLL_INTERVAL
+        budget = token_scheduler.capacity(self.endpoint, self.default_limit) * POLL_BUDGET_SHARE / self.requests_per_poll
+        if budget <= 0:
+            return MAX_POLL_INTERVAL
+        interval = self._weight_sum / (budget * stats["weight"])
+        return min(max(interval, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+
+    def note_cost(self, requests, polls):
+        """Track how many requests a poll costs on average (packed search queries)"""
+        if polls:
+            self.requests_per_poll += self.EWMA_ALPHA * (requests / polls - self.requests_per_poll)
+
+    def _push(self, user_id, stats, due):
+        stats["due"] = due
+        stats["seq"] = next(self._seq)
+        heapq.heappush(self._heap, (due, stats["seq"], user_id))
+
+    def pop_due(self, now, limit):
+        """Take up to `limit` accounts whose poll is due"""
+        due = []
+        while self._heap and len(due) < limit and self._heap[0][0] <= now:
+            _, seq, user_id = heapq.heappop(self._heap)
+            stats = self._accounts.get(user_id)
+            if stats is None or stats["seq"] != seq:
+                continue  # Stale entry left behind by a reschedule or removal
+            due.append(user_id)
+        return due
+
+    def requeue(self, user_ids):
+        """Put popped accounts back, still due, when there was no slot to poll them"""
+        for user_id in user_ids:
+            stats = self._accounts.get(user_id)
+            if stats is not None:
+                self._push(user_id, stats, stats["due"])
+
+    def reschedule(self, user_id, ok):
+        """Queue the next poll after one finished (ok=False backs off)"""
+        stats = self._accounts.get(user_id)
+        if stats is None:
+            return
+        now = time.time()
+        stats["failures"] = 0 if ok else stats["failures"] + 1
+        self._update_weight(stats, now)
+        interval = self.interval(user_id)
+        if stats["failures"]:
+            interval = min(interval * 2 ** stats["failures"], MAX_POLL_INTERVAL)
+        self._push(user_id, stats, now + interval)
+
+    def next_due(self) -> Optional[float]:
+        while self._heap:
+            due, seq, user_id = self._heap[0]
+            stats = self._accounts.get(user_id)
+            if stats is not None and stats["seq"] == seq:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+poll_scheduler = PollScheduler()
+
+async def process_account(account: AccountState, channel):
+    """Fetch one account's timeline, queue its new tweets and advance its cursor.
+
+    Returns (status, texts) where status is "posted", "unchanged" or "failed".
+    """
+    last_tweet_id = account.get("last_tweet_id")
+    if last_tweet_id is None:
+        # No cursor yet: start from the most recent tweet only. It may be
+        # days old, so it isn't traced for latency
+        tweet = await get_latest_tweet(account["x_user_id"])
+        new_tweets = [tweet] if tweet else None
+        return await deliver_new_tweets(account, channel, new_tweets)
+    requested = time.time()
+    new_tweets = await get_new_tweets(account["x_user_id"], last_tweet_id)
+    return await deliver_new_tweets(account, channel, new_tweets, (requested, time.time()))
+
+async def process_search_batch(accounts: List[AccountState], channel):
+    """Fetch many accounts with one packed search query; returns a result per account"""
+    requested = time.time()
+    by_author, newest_id, requests = await search_new_tweets(accounts)
+    poll_scheduler.note_cost(requests, len(accounts))
+    if by_author is None:
+        return [("failed", []) for _ in accounts]
+    fetch_times = (requested, time.time())
+    results = []
+    for account in accounts:
+        results.append(await deliver_new_tweets(account, channel, by_author[account["x_user_id"]], fetch_times))
+        # Only once its tweets are staged, so a failed delivery is searched again
+        if newest_id is not None and results[-1][0] != "failed" and owns_account(account["x_user_id"]):
+            user_id = account["x_user_id"]
+            if user_id not in searched_through or snowflake(newest_id) > snowflake(searched_through[user_id]):
+                searched_through[user_id] = newest_id
+    return results
+
+async def deliver_new_tweets(account: AccountState, default_channel, new_tweets: Optional[List[Tweet]], fetch_times=None):
+    """Queue an account's new tweets oldest-first to its channels and advance its cursor.
+
+    fetch_times is (requested, fetched) of the poll that found them, for tracing.
+    """
+    if new_tweets is None:
+        return "failed", []
+    poll_scheduler.observe(account["x_user_id"], new_tweets)
+    channels = account_channels(account, default_channel)
+    if not new_tweets or not channels:
+        return "unchanged", []
+
+    last_tweet_id = account.get("last_tweet_id")
+    texts = []
+    for tweet in new_tweets:
+        # Never repost an older tweet (e.g. after the newest one was deleted)
+        if last_tweet_id is not None and snowflake(tweet.id) <= snowflake(last_tweet_id):
+            continue
+        trace = latency_tracer.start(tweet, account, fetch_times)
+        text, formatted_message = format_tweet_message(tweet, account["x_username"])
+        rendered = {channel: render_tweet(channel, formatted_message, tweet.media) for channel in channels}
+        # A new block of outbox IDs may wait on other workers' writes:
+        # reserve it off the event loop, before the lock
+        count = sum(len(messages) for messages in rendered.values())
+        outbox_ids = store.take_outbox_ids(count) or await asyncio.to_thread(store.reserve_outbox_ids, count)
+
+        # The outbox rows, the cursor and the dedup entries are group-committed
+        # together: after a crash a tweet is either fetched again or replayed
+        # from the outbox, never both
+        async with state_lock:
+            if not owns_account(account["x_user_id"]):
+                # Handed to another worker mid-poll; it resumes from the committed cursor
+                break
+            # Claimed under the lock so a concurrent /checknow can't post it too
+            targets = [channel for channel in channels if not dedup_index.seen(channel, tweet.id)]
+            target_messages = [rendered[channel] for channel in targets]
+            with store.batch():
+                # Every channel in one call: staged all together or not at all
+                batches = store.stage_outbox(target_messages, outbox_ids[:sum(map(len, target_messages))])
+                current = account.get("last_tweet_id")
+                if current is None or snowflake(tweet.id) > snowflake(current):
+                    account["last_tweet_id"] = tweet.id
+                    store.set_cursor(account["x_user_id"], tweet.id)
+                for channel in targets:
+                    store.record_delivered(channel, tweet.id)
+            # Only once staged: if staging raises, the tweet is fetched and tried again
+            for channel in targets:
+                dedup_index.add(channel, tweet.id)
+        if batches:
+            # Waits here when the delivery queue is full, slowing polling down
+            await deliver_tweet(account, batches, trace)
+            texts.append(text)
+            print(f"Queued NEW tweet from @{account['x_username']} for {len(targets)} channel(s): {text[:40]}...")
+    return ("posted" if texts else "unchanged"), texts
+
+def plan_poll_jobs(accounts: List[AccountState]):
+    """Group accounts into poll jobs: one account each, or packed search batches"""
+    if POLL_MODE != "search":
+        return [[a] for a in accounts]
+    # Accounts without a cursor bootstrap from their timeline first
+    jobs = [[a] for a in accounts if a.get("last_tweet_id") is None]
+    by_username = {a["x_username"]: a for a in accounts if a.get("last_tweet_id") is not None}
+    for usernames in pack_search_queries(list(by_username)):
+        jobs.append([by_username[u] for u in usernames])
+    return jobs
+
+async def run_poll_job(job: List[AccountState], channel):
+    searched = POLL_MODE == "search" and job[0].get("last_tweet_id") is not None
+    started = time.monotonic()
+    results = [("failed", [])] * len(job)
+    try:
+        if searched:
+            results = await process_search_batch(job, channel)
+        else:
+            results = [await process_account(job[0], channel)]
+        return results
+    finally:
+        POLL_SECONDS.observe(time.monotonic() - started, kind="search" if searched else "timeline")
+        for poll_status, _ in results:
+            POLLS.inc(status=poll_status)
+
+async def poll_accounts(accounts: List[AccountState], channel):
+    """Poll many accounts concurrently, at most MAX_IN_FLIGHT jobs at a time.
+
+    Returns one (status, texts) result or exception per account, in order.
+    """
+    semaphore = asyncio.Semaphore(MAX_IN_FLIGHT)
+    jobs = plan_poll_jobs(accounts)
+
+    async def poll_one(job):
+        async with semaphore:
+            return await run_poll_job(job, channel)
+
+    job_results = await asyncio.gather(*(poll_one(job) for job in jobs), return_exceptions=True)
+    results = {}
+    for job, job_result in zip(jobs, job_results):
+        for i, account in enumerate(job):
+            results[account["x_user_id"]] = job_result if isinstance(job_result, BaseException) else job_result[i]
+    return [results[a["x_user_id"]] for a in accounts]
+
+# --- Sharding ---
+def ring_hash(value) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+class HashRing:
+    """Consistent hashing of account IDs onto workers.
+
+    Each worker sits at VNODES points on a 64-bit ring and owns the keys
+    that hash up to its points, so a worker joining or leaving moves only
+    about 1/N of the accounts.
+    """
+
+    VNODES = 64
+
+    def __init__(self, workers):
+        points = sorted((ring_hash(f"{worker}#{i}"), worker) for worker in workers for i in range(self.VNODES))
+        self._hashes = [h for h, _ in points]
+        self._workers = [worker for _, worker in points]
+
+    def owner(self, key) -> Optional[str]:
+        if not self._workers:
+            return None
+        return self._workers[bisect.bisect(self._hashes, ring_hash(key)) % len(self._workers)]
+
+def token_fingerprint(token) -> str:
+    """Stable name for a bearer token that workers can share without the secret"""
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+class ShardCoordinator:
+    """Splits the watched accounts between workers sharing one state database.
+
+    Every LEASE_TTL/3 seconds a worker heartbeats, works out its accounts by
+    consistent hashing over the live workers and syncs its leases: an
+    account is only taken once its previous owner released it or let the
+    lease expire, so two workers never poll the same account. A worker
+    stops staging for an account and commits before releasing it, and the
+    next owner reloads the committed cursor. Workers that miss their
+    heartbeats for LEASE_TTL are reaped and their pending outbox adopted.
+    Rate-limit observations are shared through the database and every
+    worker paces itself on an equal share of each token's budget.
+    """
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.workers: List[str] = []
+        self.owned: set = set()
+        self.lease_until = 0.0
+        self._shared_until = 0.0
+        self._fingerprints = [token_fingerprint(t) for t in X_BEARER_TOKENS]
+
+    def owns(self, user_id) -> bool:
+        return user_id in self.owned and time.time() < self.lease_until
+
+    async def run(self):
+        while True:
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                print(f"Error in shard heartbeat: {e}")
+            await asyncio.sleep(LEASE_TTL / 3)
+
+    async def heartbeat(self):
+        now = time.time()
+        if not await asyncio.to_thread(store.heartbeat, self.worker_id, now) and self.owned:
+            # Reaped while stalled: our leases may be gone, start over
+            print(f"⚠️ Worker {self.worker_id} missed its heartbeats and was presumed dead, rejoining")
+            async with state_lock:
+                self.owned = set()
+
+        dead, adopted = await asyncio.to_thread(store.reap_workers, self.worker_id, now - LEASE_TTL)
+        if dead:
+            print(f"🪦 Worker(s) {', '.join(dead)} stopped, adopting {len(adopted)} undelivered message(s)")
+        for outbox_id, chat_id, method, data in adopted:
+            await delivery_queue.submit(chat_id, method, data, outbox_id)
+
+        self.workers = await asyncio.to_thread(store.live_workers, now - LEASE_TTL)
+        token_scheduler.share = 1 / max(len(self.workers), 1)
+        await self.share_budgets()
+
+        ring = HashRing(self.workers)
+        async with state_lock:
+            self.refresh_config()
+            wanted = {a["x_user_id"] for a in config["accounts"] if ring.owner(a["x_user_id"]) == self.worker_id}
+            # deliver_new_tweets checks owns() under state_lock, so nothing is
+            # staged for these accounts from here on
+            self.owned &= wanted
+
+        granted = await asyncio.to_thread(self.sync_leases, wanted, now)
+        async with state_lock:
+            gained = granted - self.owned
+            if gained:
+                # The previous owner committed before releasing these
+                for user_id, cursor in store.cursors(gained).items():
+                    account = find_account(user_id)
+                    if account:
+                        account["last_tweet_id"] = cursor
+            self.owned = granted
+            self.lease_until = now + LEASE_TTL
+        if gained:
+            print(f"🧩 Worker {self.worker_id} took over {len(gained)} account(s), now owns {len(granted)}")
+
+    def sync_leases(self, wanted, now):
+        # Commit what was staged for accounts moving away before anyone else may take them
+        store.flush()
+        return store.sync_leases(self.worker_id, wanted, now, now + LEASE_TTL)
+
+    def refresh_config(self):
+        """Pick up account and channel changes made through other workers (under state_lock)"""
+        loaded = store.load()
+        current = {a["x_user_id"]: a for a in config["accounts"]}
+        accounts = []
+        for stored in loaded["accounts"]:
+            account = current.get(stored["x_user_id"])
+            if account is None:
+                account = stored
+            else:
+                account["x_username"] = stored["x_username"]
+                account["channels"] = stored["channels"]
+                if stored["x_user_id"] not in self.owned:
+                    account["last_tweet_id"] = stored["last_tweet_id"]
+            accounts.append(account)
+        config["accounts"] = accounts
+        config["telegram_channel"] = loaded["telegram_channel"]
+
+    async def share_budgets(self):
+        """Publish this worker's rate-limit observations and merge everyone else's"""
+        since, self._shared_until = self._shared_until, time.time()
+        published = [
+            (self._fingerprints[index], endpoint, limit, remaining, reset_at, observed_at)
+            for index, endpoint, limit, remaining, reset_at, observed_at in token_scheduler.observations(since)
+        ]
+        rows = await asyncio.to_thread(store.share_budgets, published)
+        indexes = {fingerprint: index for index, fingerprint in enumerate(self._fingerprints)}
+        for fingerprint, endpoint, limit, remaining, reset_at, observed_at in rows:
+            if fingerprint in indexes:
+                token_scheduler.merge(indexes[fingerprint], endpoint, limit, remaining, reset_at, observed_at)
+
+shard_coordinator = ShardCoordinator(WORKER_ID) if WORKER_ID else None
+
+def owns_account(user_id) -> bool:
+    """Whether this process polls the account: always, unless sharded"""
+    return shard_coordinator is None or shard_coordinator.owns(user_id)
 
 # --- Commands ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -223,11 +2522,16 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "👋 Hi! Use:\n"
             "/setusername <username> → set X account\n"
+            "/addaccount <username> [...] → watch more X accounts\n"
+            "/removeaccount <username> → stop watching an X account\n"
+            "/accounts → list watched X accounts\n"
             "/setchannel <@channel or id> → set Telegram channel\n"
+            "/route <username> [@channel ...] → post an account to its own channels\n"
             "/status → check current settings\n"
             "/testpost → send a test post to your channel\n"
             "/checknow → manually check for new tweets\n"
             "/ratelimit → check X API rate limit status\n"
+            "/latency → tweet-to-channel latency percentiles\n"
             "/login → add yourself as authorized user\n"
             "/logout → remove yourself as authorized user"
         )
@@ -286,17 +2590,88 @@ async def set_username(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⚠️ Usage: /setusername <username>")
         return
 
-    username = context.args[0].replace("@", "")
-    user_id = get_user_id_from_username(username)
+    user = (await resolve_usernames([context.args[0]])).get(context.args[0].replace("@", "").lower())
 
-    if user_id:
-        config["x_user_id"] = user_id
-        config["x_username"] = username
-        save_config(config)
+    if user:
+        user_id, username = user
+        async with state_lock:
+            config["accounts"] = [{"x_user_id": user_id, "x_username": username, "last_tweet_id": None, "channels": []}]
+            store.replace_accounts(config["accounts"])
         await update.message.reply_text(f"✅ X account set to @{username} (ID: {user_id})")
     else:
         await update.message.reply_text("❌ Could not find that username.")
 
+async def add_account(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.effective_user or not is_authorized(update.effective_user.id):
+        if update.message:
+            await update.message.reply_text("❌ You are not authorized to use this command. Use /login first.")
+        return
+    if not update.message:
+        return
+    if not context.args:
+        await update.message.reply_text("⚠️ Usage: /addaccount <username> [username ...]")
+        return
+
+    requested = [arg.replace("@", "") for arg in context.args]
+    resolved = await resolve_usernames(requested)
+    added = []
+    failed = [u for u in requested if u.lower() not in resolved]
+    async with state_lock:
+        for user_id, username in resolved.values():
+            if not find_account(user_id):
+                account: AccountState = {"x_user_id": user_id, "x_username": username, "last_tweet_id": None, "channels": []}
+                config["accounts"].append(account)
+                store.add_account(account)
+            added.append(username)
+
+    msg = ""
+    if added:
+        msg += "✅ Watching: " + ", ".join(f"@{u}" for u in added) + "\n"
+    if failed:
+        msg += "❌ Could not find: " + ", ".join(f"@{u}" for u in failed) + "\n"
+    msg += f"👀 Total watched accounts: {len(config['accounts'])}"
+    await update.message.reply_text(msg)
+
+async def remove_account(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.effective_user or not is_authorized(update.effective_user.id):
+        if update.message:
+            await update.message.reply_text("❌ You are not authorized to use this command. Use /login first.")
+        return
+    if not update.message:
+        return
+    if not context.args:
+        await update.message.reply_text("⚠️ Usage: /removeaccount <username>")
+        return
+
+    username = context.args[0].replace("@", "").lower()
+    async with state_lock:
+        removed = [a for a in config["accounts"] if a["x_username"].lower() == username]
+        for account in removed:
+            config["accounts"].remove(account)
+            store.remove_account(account["x_user_id"])
+    if removed:
+        await update.message.reply_text(f"✅ Stopped watching @{username}")
+    else:
+        await update.message.reply_text(f"ℹ️ @{username} is not being watched.")
+
+async def list_accounts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message:
+        return
+    accounts = config["accounts"]
+    if not accounts:
+        await update.message.reply_text("ℹ️ No X accounts are being watched. Use /addaccount")
+        return
+    msg = f"👀 Watching {len(accounts)} X accounts:\n"
+    for account in accounts[:50]:  # Keep the reply under Telegram's message limit
+        interval = int(poll_scheduler.interval(account["x_user_id"]))
+        msg += f"• @{account['x_username']} (every {interval}s, last tweet: {account.get('last_tweet_id') or 'none'})"
+        if account.get("channels"):
+            msg += f" → {', '.join(account['channels'])}"
+        msg += "\n"
+    if len(accounts) > 50:
+        msg += f"• ... and {len(accounts) - 50} more\n"
+    await update.message.reply_text(msg)
+
 async def set_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or not is_authorized(update.effective_user.id):
         if update.message:
@@ -307,42 +2682,82 @@ async def set_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         await update.message.reply_text("⚠️ Usage: /setchannel <@channel or chat_id>")
         return
-    config["telegram_channel"] = context.args[0]
-    save_config(config)
+    async with state_lock:
+        config["telegram_channel"] = context.args[0]
+        store.set_setting("telegram_channel", config["telegram_channel"])
     await update.message.reply_text(f"✅ Telegram channel set to {config['telegram_channel']}")
 
+async def route_account(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.effective_user or not is_authorized(update.effective_user.id):
+        if update.message:
+            await update.message.reply_text("❌ You are not authorized to use this command. Use /login first.")
+        return
+    if not update.message:
+        return
+    if not context.args:
+        await update.message.reply_text("⚠️ Usage: /route <username> [@channel or chat_id ...]")
+        return
+
+    username = context.args[0].replace("@", "").lower()
+    channels = list(dict.fromkeys(context.args[1:]))
+    async with state_lock:
+        routed = [a for a in config["accounts"] if a["x_username"].lower() == username]
+        for account in routed:
+            account["channels"] = channels
+            store.set_routes(account["x_user_id"], channels)
+    if not routed:
+        await update.message.reply_text(f"ℹ️ @{username} is not being watched. Use /addaccount first.")
+    elif channels:
+        await update.message.reply_text(f"✅ @{username} now posts to {', '.join(channels)}")
+    else:
+        await update.message.reply_text(f"✅ @{username} now posts to the default channel")
+
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
     msg = "📊 Current Config:\n"
-    msg += f"• X Username: @{config.get('x_username', '❌ Not set')}\n"
-    msg += f"• X User ID: {config.get('x_user_id', '❌ Not set')}\n"
-    msg += f"• Telegram Channel: {config.get('telegram_channel', '❌ Not set')}\n"
-    msg += f"• Last Tweet ID: {config.get('last_tweet_id', '❌ None')}\n\n"
+    msg += f"• X Accounts: {len(config['accounts'])} watched\n"
+    for account in config["accounts"][:5]:
+        msg += f"  @{account['x_username']} (ID: {account['x_user_id']}, last tweet: {account.get('last_tweet_id') or 'none'})\n"
+    if len(config["accounts"]) > 5:
+        msg += f"  ... and {len(config['accounts']) - 5} more (see /accounts)\n"
+    msg += f"• Telegram Channel: {config.get('telegram_channel') or '❌ Not set'}\n"
+    routed = sum(1 for a in config["accounts"] if a.get("channels"))
+    if routed:
+        msg += f"• Routed accounts: {routed} with their own channels (see /accounts)\n"
+    if shard_coordinator:
+        msg += (f"• Shard: worker {shard_coordinator.worker_id} of {len(shard_coordinator.workers)} live, "
+                f"polling {len(shard_coordinator.owned)} account(s)\n")
+    outbox = store.outbox_counts()
+    if outbox:
+        msg += f"• Outbox: {outbox.get('pending', 0)} pending, {outbox.get('failed', 0)} failed\n"
+    msg += "\n"
     
     # Show multiple X accounts info
     msg += f"🔑 X API Accounts: {len(X_BEARER_TOKENS)} configured\n"
     if X_BEARER_TOKENS:
-        msg += f"• Current token: #{current_token_index + 1}\n"
-        
-        # Show rate limit status for each token
+        # Show rate limit budget for each token and endpoint
         current_time = time.time()
+        budgets = token_scheduler.snapshot()
+        open_circuits = token_scheduler.open_circuits()
         for i, token in enumerate(X_BEARER_TOKENS):
-            token_info = token_rate_limits.get(i, {'last_rate_limit': 0, 'wait_time': 0})
-            if token_info['last_rate_limit'] == 0:
-                status_emoji = "✅"
-                status_text = "Available"
-            else:
-                remaining_wait = token_info['wait_time'] - (current_time - token_info['last_rate_limit'])
-                if remaining_wait <= 0:
-                    status_emoji = "✅"
-                    status_text = "Available"
-                else:
+            if i in open_circuits:
+                msg += f"  Token {i+1}: 🔌 Failing, skipped (next probe in {int(open_circuits[i])}s)\n"
+            token_budgets = sorted((endpoint, b) for (idx, endpoint), b in budgets.items() if idx == i)
+            if not token_budgets:
+                msg += f"  Token {i+1}: ✅ Unused\n"
+                continue
+            for endpoint, budget in token_budgets:
+                reset_in = max(0, int(budget["reset_at"] - current_time))
+                if budget["remaining"] is None:
+                    status_emoji, status_text = "✅", "Available"
+                elif budget["remaining"] <= 0 and reset_in > 0:
                     status_emoji = "⏳"
-                    minutes = int(remaining_wait // 60)
-                    seconds = int(remaining_wait % 60)
-                    status_text = f"Rate limited ({minutes}m {seconds}s)"
-            msg += f"  Token {i+1}: {status_emoji} {status_text}\n"
+                    status_text = f"Rate limited ({reset_in // 60}m {reset_in % 60}s)"
+                else:
+                    status_emoji = "✅"
+                    status_text = f"{budget['remaining']}/{budget['limit']} left, resets in {reset_in // 60}m {reset_in % 60}s"
+                msg += f"  Token {i+1} {endpoint}: {status_emoji} {status_text}\n"
     
     # Show authorized users
     msg += f"\n👥 Authorized Users: {len(AUTHORIZED_USERS) + 1}\n"
@@ -373,8 +2788,10 @@ async def test_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     formatted_message = f"{test_text}\n\n🔗: {test_link}\n\nFollow My Account: {test_account}"
     
-    post_text(config["telegram_channel"], formatted_message)
-    await update.message.reply_text("✅ Test post sent to your channel!")
+    if await (await post_text(config["telegram_channel"], formatted_message)):
+        await update.message.reply_text("✅ Test post sent to your channel!")
+    else:
+        await update.message.reply_text("❌ Test post failed. Check the channel and the bot's admin rights.")
 
 async def check_now(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or not is_authorized(update.effective_user.id):
@@ -384,42 +2801,31 @@ async def check_now(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
     
-    if not config.get("x_user_id"):
+    if not config["accounts"]:
         await update.message.reply_text("❌ Please set an X username first with /setusername")
         return
-    if not config.get("telegram_channel"):
+    if not any(account_channels(a, config.get("telegram_channel")) for a in config["accounts"]):
         await update.message.reply_text("❌ Please set a Telegram channel first with /setchannel")
         return
     
     await update.message.reply_text("🔍 Checking for new tweets...")
     
     try:
-        tweet, media_urls = get_latest_tweet(config["x_user_id"])
-        if tweet:
-            tweet_id = tweet["id"]
-            if tweet_id != config.get("last_tweet_id"):
-                text = tweet.get("text", "")
-                # Remove t.co links from the tweet text
-                text = re.sub(r'https://t\.co/\w+', '', text).strip()
-                link = f"https://x.com/{config['x_username']}/status/{tweet_id}"
-                account_link = f"https://x.com/{config['x_username']}"
-                
-                formatted_message = f"{text}\n\n🔗: {link}\n\nFollow My Account: {account_link}"
-
-                if media_urls:
-                    post_photo(config["telegram_channel"], media_urls[0], formatted_message)
-                    for extra in media_urls[1:]:
-                        post_photo(config["telegram_channel"], extra)
-                else:
-                    post_text(config["telegram_channel"], formatted_message)
-
-                config["last_tweet_id"] = tweet_id
-                save_config(config)
-                await update.message.reply_text(f"✅ Posted new tweet: {text[:50]}...")
-            else:
-                await update.message.reply_text("ℹ️ No new tweets found since last check")
-        else:
+        accounts = [a for a in config["accounts"] if owns_account(a["x_user_id"])]
+        if not accounts:
+            await update.message.reply_text("ℹ️ This worker holds no account leases right now, the other workers poll them")
+            return
+        results = await poll_accounts(accounts, config["telegram_channel"])
+        posted = [text for r in results if not isinstance(r, BaseException) for text in r[1]]
+        failed = [r for r in results if isinstance(r, BaseException) or r[0] == "failed"]
+        if posted:
+            msg = f"✅ Posted {len(posted)} new tweet(s):\n"
+            msg += "\n".join(f"• {text[:50]}..." for text in posted[:10])
+            await update.message.reply_text(msg)
+        elif len(failed) == len(results):
             await update.message.reply_text("❌ Could not fetch tweets (may be rate limited)")
+        else:
+            await update.message.reply_text("ℹ️ No new tweets found since last check")
     except Exception as e:
         await update.message.reply_text(f"❌ Error checking tweets: {str(e)}")
 
@@ -431,132 +2837,379 @@ async def rate_limit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
     
-    global last_rate_limit_time, current_wait_time
-    
-    if last_rate_limit_time == 0:
+    # The endpoint polling actually spends: recent search in POLL_MODE=search
+    remaining_wait = token_scheduler.wait_time(poll_scheduler.endpoint)
+    if remaining_wait <= 0:
         await update.message.reply_text("✅ No rate limit detected. You can check for tweets now with /checknow")
     else:
-        time_since_limit = time.time() - last_rate_limit_time
-        remaining_wait = max(0, current_wait_time - time_since_limit)
-        
-        if remaining_wait > 0:
-            minutes = int(remaining_wait // 60)
-            seconds = int(remaining_wait % 60)
-            if minutes > 0:
-                wait_text = f"{minutes} minutes, {seconds} seconds"
-            else:
-                wait_text = f"{seconds} seconds"
-            
-            await update.message.reply_text(
-                f"⏳ Rate limited by X API\n"
-                f"Wait approximately: {wait_text}\n"
-                f"Try /checknow after this time."
-            )
+        minutes = int(remaining_wait // 60)
+        seconds = int(remaining_wait % 60)
+        if minutes > 0:
+            wait_text = f"{minutes} minutes, {seconds} seconds"
         else:
-            await update.message.reply_text("✅ Rate limit should be cleared. Try /checknow now!")
+            wait_text = f"{seconds} seconds"
+        
+        await update.message.reply_text(
+            f"⏳ Rate limited by X API\n"
+            f"Wait approximately: {wait_text}\n"
+            f"Try /checknow after this time."
+        )
+
+async def show_latency(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.effective_user or not is_authorized(update.effective_user.id):
+        if update.message:
+            await update.message.reply_text("❌ You are not authorized to use this command. Use /login first.")
+        return
+    if not update.message:
+        return
+
+    traces = latency_tracer.recent()
+    if not traces:
+        await update.message.reply_text("ℹ️ No tweets delivered since the bot started.")
+        return
+    msg = f"⏱ Tweet latency over the last {len(traces)} deliveries (p50 / p95 / p99):\n"
+    for stage, percentiles in latency_tracer.summary().items():
+        msg += f"• {stage}: " + " / ".join(f"{percentiles[p]:.1f}s" for p in ("p50", "p95", "p99")) + "\n"
+    slowest = max(traces, key=lambda t: t.stages()["total"])
+    msg += f"\n🐢 Slowest: @{slowest.username} {slowest.tweet_id} to {slowest.channel} in {slowest.stages()['total']:.1f}s"
+    await update.message.reply_text(msg)
 
 # --- Bot Loop ---
-def bot_loop():
-    global current_wait_time
-    rate_limit_delay = CHECK_INTERVAL
+# Strong references to long-running tasks so they aren't garbage collected
+background_tasks = set()
+
+async def start_engine():
+    """Start the delivery workers and state maintenance on the running loop"""
+    global delivery_queue
+    delivery_queue = DeliveryQueue(DELIVERY_WORKERS, DELIVERY_QUEUE_SIZE)
+    delivery_queue.start()
+    coros = [flush_state(), revalidate_usernames_periodically(), replay_outbox()]
+    if shard_coordinator:
+        coros.append(shard_coordinator.run())
+    for coro in coros:
+        task = asyncio.create_task(coro)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+async def replay_outbox():
+    """Send what a previous run staged but never saw Telegram confirm"""
+    pending = store.pending_outbox()
+    if pending:
+        print(f"📮 Replaying {len(pending)} undelivered message(s) from the outbox")
+    for outbox_id, chat_id, method, data in pending:
+        await delivery_queue.submit(chat_id, method, data, outbox_id)
+
+async def run_poller():
+    in_flight = set()
+
+    async def poll_and_reschedule(job, channel):
+        try:
+            results = await run_poll_job(job, channel)
+        except Exception as e:
+            print(f"Error polling {', '.join('@' + a['x_username'] for a in job)}: {e}")
+            results = [("failed", [])] * len(job)
+        for account, (status, _) in zip(job, results):
+            poll_scheduler.reschedule(account["x_user_id"], status != "failed")
+
     while True:
         try:
-            if config["x_user_id"] and config["telegram_channel"]:
-                tweet, media_urls = get_latest_tweet(config["x_user_id"])
-                if tweet:
-                    tweet_id = tweet["id"]
-                    stored_last_tweet_id = config.get("last_tweet_id")
-                    
-                    # Only post if this is truly a NEW tweet (different ID from stored one)
-                    if stored_last_tweet_id is None or tweet_id != stored_last_tweet_id:
-                        text = tweet.get("text", "")
-                        # Remove t.co links from the tweet text
-                        text = re.sub(r'https://t\.co/\w+', '', text).strip()
-                        link = f"https://x.com/{config['x_username']}/status/{tweet_id}"
-                        account_link = f"https://x.com/{config['x_username']}"
-                        
-                        formatted_message = f"{text}\n\n🔗: {link}\n\nFollow My Account: {account_link}"
-
-                        if media_urls:
-                            post_photo(config["telegram_channel"], media_urls[0], formatted_message)
-                            for extra in media_urls[1:]:
-                                post_photo(config["telegram_channel"], extra)
-                        else:
-                            post_text(config["telegram_channel"], formatted_message)
-
-                        # IMMEDIATELY update and save the last tweet ID to prevent duplicates
-                        config["last_tweet_id"] = tweet_id
-                        save_config(config)
-                        print(f"Posted NEW tweet: {text[:40]}...")
-                        
-                        # Reset delay on successful post
-                        rate_limit_delay = CHECK_INTERVAL
-                    else:
-                        # Same tweet as before - no action needed
-                        rate_limit_delay = CHECK_INTERVAL
-                elif tweet is None:
-                    # Likely rate limited, increase delay
-                    rate_limit_delay = min(rate_limit_delay * 2, 900)  # Max 15 minutes
-                    current_wait_time = rate_limit_delay  # Track current wait time
-                    print(f"Rate limited. Waiting {rate_limit_delay} seconds...")
+            async with state_lock:
+                channel = config["telegram_channel"]
+                # Accounts with nowhere to post wait until a channel is set;
+                # sharded workers poll only the accounts they hold leases on
+                accounts = {
+                    a["x_user_id"]: a for a in config["accounts"]
+                    if account_channels(a, channel) and owns_account(a["x_user_id"])
+                }
+            poll_scheduler.sync(list(accounts))
+
+            token_wait = token_scheduler.wait_time(poll_scheduler.endpoint)
+            if accounts and token_wait <= TOKEN_MAX_WAIT:
+                free_slots = MAX_IN_FLIGHT - len(in_flight)
+                # A packed search query covers many accounts, so take more per slot
+                limit = free_slots * 100 if POLL_MODE == "search" else free_slots
+                due = [accounts[user_id] for user_id in poll_scheduler.pop_due(time.time(), limit)]
+                # Accounts without a cursor each become a job of their own, so
+                # start the most overdue jobs and hand the rest back for later
+                order = {account["x_user_id"]: i for i, account in enumerate(due)}
+                jobs = sorted(plan_poll_jobs(due), key=lambda job: min(order[a["x_user_id"]] for a in job))
+                for job in jobs[free_slots:]:
+                    poll_scheduler.requeue([a["x_user_id"] for a in job])
+                for job in jobs[:free_slots]:
+                    task = asyncio.create_task(poll_and_reschedule(job, channel))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+            elif token_wait > TOKEN_MAX_WAIT:
+                # Every token is spent: sleep until one resets instead of a fixed penalty
+                print(f"Rate limited. Waiting {int(token_wait)} seconds...")
+                await asyncio.sleep(min(token_wait, 900))
+                continue
+
+            POLL_IN_FLIGHT.set(len(in_flight))
+            # Wake for the next due account, a finished poll, or a config change
+            next_due = poll_scheduler.next_due()
+            timeout = 1.0 if next_due is None else min(max(next_due - time.time(), 0.05), 1.0)
+            if in_flight and len(in_flight) >= MAX_IN_FLIGHT:
+                await asyncio.wait(in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(timeout)
         except Exception as e:
             print("Error in bot loop:", e)
-            # On error, also increase delay
-            rate_limit_delay = min(rate_limit_delay * 1.5, 900)
-            current_wait_time = rate_limit_delay
+            await asyncio.sleep(CHECK_INTERVAL)
 
-        time.sleep(rate_limit_delay)
+# --- Filtered stream ---
+STREAM_RULE_TAG = "twitter-telegram-bot"
 
-# --- Run Everything ---
-if __name__ == "__main__":
-    print("Starting Twitter-to-Telegram Bot...")
-    print(f"X Bearer Tokens: {len(X_BEARER_TOKENS)} configured" if X_BEARER_TOKENS else "X Bearer Tokens: NOT SET")
-    print(f"Telegram Token: {'Set' if TELEGRAM_TOKEN != 'your_telegram_bot_token' else 'NOT SET'}")
-    print(f"Admin ID: {ADMIN_ID}")
-    
-    # Start Flask keepalive server
-    threading.Thread(target=run_flask, daemon=True).start()
-    threading.Thread(target=bot_loop, daemon=True).start()
-    print("Bot loop and Flask server started...")
-    
+async def sync_stream_rules(usernames):
+    """Make our filtered-stream rules cover exactly these usernames.
+
+    Only rules tagged STREAM_RULE_TAG are touched, so rules other apps
+    keep on the same project survive.
+    """
+    token = X_BEARER_TOKENS[0]
+    response = await x_api_get("/2/tweets/search/stream/rules", token)
+    if response.status_code != 200:
+        print(f"X API error {response.status_code} listing stream rules: {response.text}")
+        return False
+    current = {r["value"]: r["id"] for r in response.json().get("data", []) if r.get("tag") == STREAM_RULE_TAG}
+    wanted = {" OR ".join(f"from:{u}" for u in group) for group in pack_search_queries(usernames, STREAM_RULE_MAX_LEN)}
+
+    stale_ids = [rule_id for value, rule_id in current.items() if value not in wanted]
+    if stale_ids:
+        response = await x_api_post("/2/tweets/search/stream/rules", token, {"delete": {"ids": stale_ids}})
+        if response.status_code != 200:
+            print(f"X API error {response.status_code} deleting stream rules: {response.text}")
+            return False
+    new_rules = [{"value": value, "tag": STREAM_RULE_TAG} for value in wanted if value not in current]
+    if new_rules:
+        response = await x_api_post("/2/tweets/search/stream/rules", token, {"add": new_rules})
+        if response.status_code not in (200, 201):
+            print(f"X API error {response.status_code} adding stream rules: {response.text}")
+            return False
+    print(f"Stream rules synced: {len(wanted)} rule(s) for {len(usernames)} account(s)")
+    return True
+
+async def keep_stream_rules_synced():
+    """Re-sync rules whenever the watched accounts change"""
+    synced = None
+    while True:
+        usernames = sorted(a["x_username"] for a in config["accounts"])
+        if usernames != synced:
+            try:
+                if await sync_stream_rules(usernames):
+                    synced = usernames
+            except Exception as e:
+                print(f"Error syncing stream rules: {e}")
+        await asyncio.sleep(5)
+
+class StreamHTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"stream returned HTTP {status_code}")
+        self.status_code = status_code
+
+async def consume_stream(on_connected):
+    """Read the filtered stream until it drops; hands each tweet to delivery"""
+    params = AUTHORED_TWEET_PARAMS
+    headers = {"Authorization": f"Bearer {X_BEARER_TOKENS[0]}"}
+    # The read timeout doubles as heartbeat detection: any line, including
+    # X's keep-alive newlines, resets it
+    timeout = httpx.Timeout(HTTP_TIMEOUT, read=STREAM_STALL_TIMEOUT)
+    async with x_http.stream("GET", "/2/tweets/search/stream", params=params, headers=headers, timeout=timeout) as response:
+        if response.status_code != 200:
+            await response.aread()
+            print(f"X stream error {response.status_code}: {response.text}")
+            raise StreamHTTPError(response.status_code)
+        print("📡 Connected to X filtered stream")
+        STREAM_CONNECTIONS.inc()
+        on_connected()
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue  # Heartbeat
+            payload = json_loads(line)
+            data = payload.get("data")
+            if not data:
+                print(f"Stream message without data: {payload}")
+                continue
+            tweet = parse_tweet(data, media_index(payload))
+            account = find_account(tweet.author_id)
+            if account:
+                received = time.time()
+                await deliver_new_tweets(account, config["telegram_channel"], [tweet], (received, received))
+
+async def run_stream():
+    """Consume the filtered stream forever, reconnecting with X's recommended backoff"""
+    if not X_BEARER_TOKENS:
+        print("No X Bearer tokens configured!")
+        return
+    rules_task = asyncio.create_task(keep_stream_rules_synced())
+    background_tasks.add(rules_task)
+    network_delay, http_delay = 0.0, 0.0
+
+    def on_connected():
+        nonlocal network_delay, http_delay
+        network_delay, http_delay = 0.0, 0.0
+        # Tweets posted while disconnected never arrive on the stream: poll for them
+        caught_up = [a for a in config["accounts"] if a.get("last_tweet_id")]
+        if caught_up:
+            task = asyncio.create_task(poll_accounts(caught_up, config["telegram_channel"]))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+
+    while True:
+        try:
+            await consume_stream(on_connected)
+            print("X stream closed by server, reconnecting...")
+        except StreamHTTPError as e:
+            if e.status_code == 429:
+                # Exponential from one minute
+                http_delay = 60.0 if http_delay < 60 else min(http_delay * 2, 960)
+            else:
+                # Exponential from 5 seconds, capped at 320
+                http_delay = 5.0 if http_delay < 5 else min(http_delay * 2, 320)
+            print(f"Reconnecting to X stream in {int(http_delay)}s...")
+            await asyncio.sleep(http_delay)
+            continue
+        except (httpx.TransportError, json.JSONDecodeError) as e:
+            print(f"X stream dropped ({type(e).__name__}: {e})")
+        except Exception as e:
+            print(f"Error in X stream: {e}")
+        # Network errors back off linearly by 250ms, capped at 16 seconds
+        network_delay = min(network_delay + 0.25, 16.0)
+        await asyncio.sleep(network_delay)
+
+async def flush_state():
+    """Group-commit staged state every STATE_FLUSH_INTERVAL seconds, or at
+    once when an outbox message is waiting to be sent. Whatever is staged
+    while one commit runs goes into the next."""
+    global flush_done
+    while True:
+        try:
+            await asyncio.wait_for(flush_requested.wait(), STATE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        flush_requested.clear()
+        done, flush_done = flush_done, asyncio.Event()
+        try:
+            await asyncio.to_thread(store.flush)
+        except Exception as e:
+            print(f"Error saving state: {e}")
+            await asyncio.sleep(1)
+        done.set()
+
+async def revalidate_usernames_periodically():
+    """Keep watched handles current without a request per account"""
+    while True:
+        try:
+            await revalidate_usernames()
+        except Exception as e:
+            print(f"Error revalidating usernames: {e}")
+        await asyncio.sleep(min(USERNAME_CACHE_TTL, 3600))
+
+def build_telegram_app():
+    # Concurrent updates so one slow command never holds up the others
+    app_tg = Application.builder().token(TELEGRAM_TOKEN).concurrent_updates(True).build()
+    app_tg.add_handler(CommandHandler("start", start))
+    app_tg.add_handler(CommandHandler("setusername", set_username))
+    app_tg.add_handler(CommandHandler("addaccount", add_account))
+    app_tg.add_handler(CommandHandler("removeaccount", remove_account))
+    app_tg.add_handler(CommandHandler("accounts", list_accounts))
+    app_tg.add_handler(CommandHandler("setchannel", set_channel))
+    app_tg.add_handler(CommandHandler("route", route_account))
+    app_tg.add_handler(CommandHandler("status", status))
+    app_tg.add_handler(CommandHandler("testpost", test_post))
+    app_tg.add_handler(CommandHandler("checknow", check_now))
+    app_tg.add_handler(CommandHandler("ratelimit", rate_limit))
+    app_tg.add_handler(CommandHandler("latency", show_latency))
+    app_tg.add_handler(CommandHandler("login", login))
+    app_tg.add_handler(CommandHandler("logout", logout))
+    return app_tg
+
+async def start_webhook(app_tg):
+    if not WEBHOOK_URL:
+        raise ValueError("TELEGRAM_MODE=webhook needs WEBHOOK_URL set to this server's public https URL")
+    await app_tg.bot.set_webhook(
+        url=WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=["message"],
+    )
+    print(f"Telegram webhook set to {WEBHOOK_URL + WEBHOOK_PATH}")
+
+async def stop_telegram_app(app_tg):
+    """Undo whatever part of initialize/start/start_polling went through"""
+    if app_tg.updater and app_tg.updater.running:
+        await app_tg.updater.stop()
+    if app_tg.running:
+        await app_tg.stop()
+    await app_tg.shutdown()
+
+async def main():
+    """Run the poller, delivery workers and Telegram commands on one event loop"""
+    global telegram_app, main_loop
+    if shard_coordinator and POLL_MODE == "stream":
+        raise ValueError("WORKER_ID sharding needs POLL_MODE=timeline or search; one filtered stream carries every account")
+    main_loop = asyncio.get_running_loop()
+    await start_engine()
+
+    app_tg = None
     # Validate Telegram token before starting bot
     if TELEGRAM_TOKEN == "your_telegram_bot_token" or not TELEGRAM_TOKEN or not TELEGRAM_TOKEN.strip():
         print("❌ WARNING: Invalid or missing Telegram token!")
         print("Please set TELEGRAM_TOKEN environment variable with a valid bot token from @BotFather")
         print("Bot will continue running tweet monitoring and Flask server, but Telegram commands will not work.")
-        print("Flask server running on port 5000 - bot loop continues monitoring tweets")
-        
-        # Keep the process alive without Telegram bot
-        try:
-            while True:
-                time.sleep(60)
-        except KeyboardInterrupt:
-            print("Bot stopped.")
+        print(f"Flask server running on port {PORT} - bot loop continues monitoring tweets")
+    elif not TELEGRAM_COMMANDS:
+        print("Telegram commands are handled by another worker (TELEGRAM_COMMANDS=false)")
     else:
         try:
             # Telegram command bot
-            app_tg = Application.builder().token(TELEGRAM_TOKEN).build()
-            app_tg.add_handler(CommandHandler("start", start))
-            app_tg.add_handler(CommandHandler("setusername", set_username))
-            app_tg.add_handler(CommandHandler("setchannel", set_channel))
-            app_tg.add_handler(CommandHandler("status", status))
-            app_tg.add_handler(CommandHandler("testpost", test_post))
-            app_tg.add_handler(CommandHandler("checknow", check_now))
-            app_tg.add_handler(CommandHandler("ratelimit", rate_limit))
-            app_tg.add_handler(CommandHandler("login", login))
-            app_tg.add_handler(CommandHandler("logout", logout))
-
+            app_tg = build_telegram_app()
+            await app_tg.initialize()
+            await app_tg.start()
+            if TELEGRAM_MODE == "webhook":
+                await start_webhook(app_tg)
+                telegram_app = app_tg
+            else:
+                await app_tg.updater.start_polling()
             print("✅ Telegram bot initialized successfully!")
-            print("Bot fully operational - Flask server on port 5000, Telegram commands active")
-            app_tg.run_polling()
+            print(f"Bot fully operational - Flask server on port {PORT}, Telegram commands active")
         except Exception as e:
             print(f"❌ Failed to start Telegram bot: {e}")
             print("Bot will continue running tweet monitoring and Flask server, but Telegram commands will not work.")
             print("Please check your Telegram token and try again.")
-            
-            # Keep the process alive without Telegram bot
-            try:
-                while True:
-                    time.sleep(60)
-            except KeyboardInterrupt:
-                print("Bot stopped.")
\ No newline at end of file
+            if app_tg:
+                try:
+                    await stop_telegram_app(app_tg)
+                except Exception as e:
+                    print(f"Error shutting down Telegram bot: {e}")
+            app_tg = None
+
+    try:
+        if POLL_MODE == "stream":
+            await run_stream()
+        else:
+            await run_poller()
+    finally:
+        if app_tg:
+            telegram_app = None
+            await stop_telegram_app(app_tg)
+        await x_http.aclose()
+        await telegram_http.aclose()
+
+# --- Run Everything ---
+if __name__ == "__main__":
+    print("Starting Twitter-to-Telegram Bot...")
+    print(f"X Bearer Tokens: {len(X_BEARER_TOKENS)} configured" if X_BEARER_TOKENS else "X Bearer Tokens: NOT SET")
+    print(f"Telegram Token: {'Set' if TELEGRAM_TOKEN != 'your_telegram_bot_token' else 'NOT SET'}")
+    print(f"Admin ID: {ADMIN_ID}")
+    if WORKER_ID:
+        print(f"Worker: {WORKER_ID} (sharing accounts through {STATE_DB})")
+    
+    # Start Flask keepalive server
+    threading.Thread(target=run_flask, daemon=True).start()
+    print("Flask server started...")
+    
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Bot stopped.")
@@ -0,0 +1,453 @@
+"""Local stand-ins for the X v2 API and the Telegram Bot API, so the bot
+can run (and be benchmarked, see bench.py) without live keys.
+
+Start them, then point the bot at them:
+
+    python mock_servers.py --port 8081 --telegram-port 8082 --accounts alice,bob --tweet-rate 0.5
+    X_API_BASE=http://127.0.0.1:8081 TELEGRAM_API_BASE=http://127.0.0.1:8082 \\
+        X_BEARER_TOKEN_1=test POLL_MODE=stream python main.py
+
+The X side serves the filtered stream (with keep-alive heartbeats and
+optional stalls to exercise reconnects), its rules endpoints, username
+lookups, user timelines and recent search. Tweets are generated at
+--tweet-rate per second across the configured accounts, some with a photo
+(--media-share). Every REST response carries x-rate-limit-* headers for
+its bearer token and endpoint; a spent budget answers 429 until the window
+resets, and --burst-every/--burst-length inject 429 bursts on top.
+--latency/--jitter delay every response.
+
+The Telegram side accepts any send method, records what was posted and
+when, and can answer every Nth call with a 429 and retry_after.
+"""
+import argparse
+import itertools
+import json
+import queue
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+TWITTER_EPOCH_MS = 1288834974657
+
+
+class MockX:
+    """In-memory X: users, their tweets, stream rules and stream subscribers"""
+
+    def __init__(self, usernames, heartbeat_interval=20.0, stall_after=None,
+                 rate_limit=None, rate_window=900.0, latency=0.0, jitter=0.0,
+                 burst_every=None, burst_length=0.0):
+        self.heartbeat_interval = heartbeat_interval
+        # Stop sending heartbeats this many seconds into each stream connection
+        self.stall_after = stall_after
+        # Requests per token per endpoint per window; None never limits
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        # Seconds added to every REST response: latency plus up to jitter
+        self.latency = latency
+        self.jitter = jitter
+        # Every burst_every seconds, answer everything with 429 for burst_length
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.users = {}  # lowercase username -> {"id", "username"}
+        self.timelines = {}  # user_id -> [tweet, ...] newest first
+        self.media = {}  # media_key -> media object
+        self.rules = {}  # rule id -> {"id", "value", "tag"}
+        self.subscribers = []
+        self.budgets = {}  # (token, endpoint) -> [remaining, reset_at]
+        self.requests = {}  # (token, endpoint, status) -> count
+        self.lock = threading.Lock()
+        self._started = time.time()
+        self._sequence = itertools.count()
+        self._rule_ids = itertools.count(1)
+        for username in usernames:
+            self.add_user(username)
+
+    def add_user(self, username):
+        with self.lock:
+            user_id = str(1000 + len(self.users))
+            self.users[username.lower()] = {"id": user_id, "username": username}
+            self.timelines[user_id] = []
+            return user_id
+
+    def _next_tweet_id(self):
+        # Real snowflake layout so the bot's ID ordering and age checks hold
+        millis = int(time.time() * 1000) - TWITTER_EPOCH_MS
+        return str((millis << 22) | (next(self._sequence) & 0x3FFFFF))
+
+    def post_tweet(self, username, text=None, photo=False):
+        """Publish a tweet: add it to the timeline and push it to matching streams"""
+        user = self.users[username.lower()]
+        tweet_id = self._next_tweet_id()
+        tweet = {
+            "id": tweet_id,
+            "text": text or f"Mock tweet {tweet_id} from @{user['username']}",
+            "author_id": user["id"],
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        }
+        if photo:
+            media_key = f"3_{tweet_id}"
+            tweet["attachments"] = {"media_keys": [media_key]}
+            with self.lock:
+                self.media[media_key] = {
+                    "media_key": media_key, "type": "photo", "url": f"https://pbs.example/{media_key}.jpg",
+                }
+        with self.lock:
+            self.timelines[user["id"]].insert(0, tweet)
+            matching = [r for r in self.rules.values() if user["username"].lower() in rule_usernames(r["value"])]
+            subscribers = list(self.subscribers)
+        if matching:
+            message = {"data": tweet, "matching_rules": [{"id": r["id"], "tag": r["tag"]} for r in matching]}
+            if photo:
+                message["includes"] = self.includes([tweet])
+            for subscriber in subscribers:
+                subscriber.put(message)
+        return tweet
+
+    def includes(self, tweets):
+        """The includes.media block for a page of tweets"""
+        keys = [key for tweet in tweets for key in tweet.get("attachments", {}).get("media_keys", [])]
+        with self.lock:
+            return {"media": [self.media[key] for key in keys if key in self.media]}
+
+    def add_rules(self, rules):
+        with self.lock:
+            added = []
+            for rule in rules:
+                rule_id = str(next(self._rule_ids))
+                self.rules[rule_id] = {"id": rule_id, "value": rule["value"], "tag": rule.get("tag")}
+                added.append(self.rules[rule_id])
+            return added
+
+    def delete_rules(self, ids):
+        with self.lock:
+            for rule_id in ids:
+                self.rules.pop(rule_id, None)
+
+    def in_burst(self, now):
+        return self.burst_every is not None and (now - self._started) % self.burst_every < self.burst_length
+
+    def charge(self, token, endpoint):
+        """Spend one request of a token's budget; returns (allowed, rate-limit headers)"""
+        now = time.time()
+        with self.lock:
+            budget = self.budgets.get((token, endpoint))
+            if budget is None or budget[1] <= now:
+                budget = self.budgets[(token, endpoint)] = [self.rate_limit, now + self.rate_window]
+            burst = self.in_burst(now)
+            allowed = not burst and (budget[0] is None or budget[0] > 0)
+            if allowed and budget[0] is not None:
+                budget[0] -= 1
+            reset_at = budget[1]
+            if burst:
+                # A burst ends with the current burst window, not the budget's
+                reset_at = now + self.burst_length - (now - self._started) % self.burst_every
+        if self.rate_limit is None and not burst:
+            return allowed, {}
+        limit = self.rate_limit if self.rate_limit is not None else 0
+        headers = {
+            "x-rate-limit-limit": str(limit),
+            "x-rate-limit-remaining": "0" if not allowed else str(budget[0] if budget[0] is not None else limit),
+            "x-rate-limit-reset": str(int(reset_at) + 1),
+        }
+        return allowed, headers
+
+    def count(self, token, endpoint, status):
+        with self.lock:
+            key = (token, endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def search(self, params):
+        """Recent search over the timelines of the query's from: users, newest first"""
+        names = rule_usernames(params.get("query", ""))
+        with self.lock:
+            user_ids = [self.users[name]["id"] for name in names if name in self.users]
+            tweets = [t for user_id in user_ids for t in self.timelines[user_id]]
+        if "since_id" in params:
+            tweets = [t for t in tweets if int(t["id"]) > int(params["since_id"])]
+        elif "start_time" in params:
+            start = datetime.strptime(params["start_time"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+            start_ms = int(start.timestamp() * 1000) - TWITTER_EPOCH_MS
+            tweets = [t for t in tweets if int(t["id"]) >> 22 >= start_ms]
+        tweets.sort(key=lambda t: int(t["id"]), reverse=True)
+        return tweets
+
+
+def rule_usernames(value):
+    return {name.lower() for name in re.findall(r"from:(\w+)", value)}
+
+
+def endpoint_name(path):
+    """The bot's name for an X endpoint, which is also how X buckets its limits"""
+    if path.startswith("/2/users/by"):
+        return "users_by"
+    if path == "/2/users":
+        return "users"
+    if re.fullmatch(r"/2/users/\w+/tweets", path):
+        return "users_tweets"
+    if path == "/2/tweets/search/recent":
+        return "search_recent"
+    return path
+
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body, headers=None):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def read_json(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            path = url.path
+
+            if path == "/2/tweets/search/stream":
+                return self.stream()
+            if path == "/2/tweets/search/stream/rules":
+                with mock.lock:
+                    rules = list(mock.rules.values())
+                return self.send_json(200, {"data": rules, "meta": {"result_count": len(rules)}})
+
+            if mock.latency or mock.jitter:
+                time.sleep(mock.latency + random.uniform(0, mock.jitter))
+            token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+            endpoint = endpoint_name(path)
+            allowed, headers = mock.charge(token, endpoint)
+            if not allowed:
+                mock.count(token, endpoint, 429)
+                return self.send_json(429, {"title": "Too Many Requests", "status": 429}, headers)
+            mock.count(token, endpoint, 200)
+
+            if path.startswith("/2/users/by/username/"):
+                user = mock.users.get(path.rsplit("/", 1)[1].lower())
+                if not user:
+                    return self.send_json(200, {"errors": [{"detail": "Could not find user"}]}, headers)
+                return self.send_json(200, {"data": user}, headers)
+            if path == "/2/users/by":
+                names = params.get("usernames", "").split(",")
+                return self.send_json(200, {"data": [mock.users[n.lower()] for n in names if n.lower() in mock.users]}, headers)
+            if path == "/2/users":
+                ids = set(params.get("ids", "").split(","))
+                return self.send_json(200, {"data": [u for u in mock.users.values() if u["id"] in ids]}, headers)
+            if path == "/2/tweets/search/recent":
+                return self.page(mock.search(params), params, "next_token", headers)
+            match = re.fullmatch(r"/2/users/(\w+)/tweets", path)
+            if match:
+                return self.timeline(match.group(1), params, headers)
+            self.send_json(404, {"title": "Not Found", "detail": path})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path == "/2/tweets/search/stream/rules":
+                body = self.read_json()
+                if "add" in body:
+                    added = mock.add_rules(body["add"])
+                    return self.send_json(201, {"data": added, "meta": {"summary": {"created": len(added)}}})
+                if "delete" in body:
+                    mock.delete_rules(body["delete"].get("ids", []))
+                    return self.send_json(200, {"meta": {"summary": {"deleted": len(body["delete"].get("ids", []))}}})
+            self.send_json(404, {"title": "Not Found", "detail": url.path})
+
+        def timeline(self, user_id, params, headers):
+            with mock.lock:
+                tweets = list(mock.timelines.get(user_id, []))
+            if "since_id" in params:
+                tweets = [t for t in tweets if int(t["id"]) > int(params["since_id"])]
+            self.page(tweets, params, "pagination_token", headers)
+
+        def page(self, tweets, params, token_param, headers):
+            max_results = int(params.get("max_results", 10))
+            start = int(params.get(token_param, 0))
+            page = tweets[start:start + max_results]
+            meta = {"result_count": len(page)}
+            if start + max_results < len(tweets):
+                meta["next_token"] = str(start + max_results)
+            body = {"meta": meta}
+            if page:
+                # Like X: newest and oldest tweet IDs on this page
+                meta["newest_id"], meta["oldest_id"] = page[0]["id"], page[-1]["id"]
+                body["data"] = page
+                includes = mock.includes(page)
+                if includes["media"]:
+                    body["includes"] = includes
+            self.send_json(200, body, headers)
+
+        def write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def stream(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            inbox = queue.Queue()
+            with mock.lock:
+                mock.subscribers.append(inbox)
+            connected_at = time.monotonic()
+            try:
+                while True:
+                    try:
+                        message = inbox.get(timeout=mock.heartbeat_interval)
+                        self.write_chunk(json.dumps(message).encode() + b"\r\n")
+                    except queue.Empty:
+                        stalled = mock.stall_after is not None and time.monotonic() - connected_at > mock.stall_after
+                        if not stalled:
+                            self.write_chunk(b"\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                with mock.lock:
+                    mock.subscribers.remove(inbox)
+
+    return Handler
+
+
+class MockTelegram:
+    """Records Bot API sends: [(received_at, method, chat_id, text or caption)]"""
+
+    def __init__(self, latency=0.0, jitter=0.0, throttle_every=None, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        # Answer every Nth call with 429 and retry_after, like a flood limit
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.sent = []
+        self.calls = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+
+    def send(self, method, fields):
+        """Result for one call, or None when this call is throttled"""
+        with self.lock:
+            self.calls += 1
+            if self.throttle_every and self.calls % self.throttle_every == 0:
+                self.throttled += 1
+                return None
+            message_id = next(self._message_ids)
+            if method == "sendMediaGroup":
+                items = json.loads(fields.get("media", "[]"))
+                text = next((item.get("caption", "") for item in items if item.get("caption")), "")
+                self.sent.append((time.time(), method, fields.get("chat_id"), text))
+                return [
+                    {"message_id": message_id, item["type"]: self._file(item["type"], item["media"])}
+                    for item in items
+                ]
+            self.sent.append((time.time(), method, fields.get("chat_id"), fields.get("text") or fields.get("caption", "")))
+        result = {"message_id": message_id}
+        kind = method.removeprefix("send").lower()
+        if kind in ("photo", "video", "animation"):
+            result[kind] = self._file(kind, fields.get(kind, ""))
+        return result
+
+    @staticmethod
+    def _file(kind, media):
+        # Photos come back as a list of sizes, the largest last
+        file_id = media if media.startswith("file-") else f"file-{abs(hash(media)) % 10 ** 12}"
+        return [{"file_id": file_id + "-small"}, {"file_id": file_id}] if kind == "photo" else {"file_id": file_id}
+
+
+def make_telegram_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            fields = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+            method = urlparse(self.path).path.rsplit("/", 1)[1]
+            if mock.latency or mock.jitter:
+                time.sleep(mock.latency + random.uniform(0, mock.jitter))
+            result = mock.send(method, fields)
+            if result is None:
+                return self.send_json(429, {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {mock.retry_after}",
+                    "parameters": {"retry_after": mock.retry_after},
+                })
+            self.send_json(200, {"ok": True, "result": result})
+
+    return Handler
+
+
+def start_server(mock, port=0, host="127.0.0.1"):
+    """Serve `mock` (a MockX or MockTelegram) on a background thread; returns the server (see .server_address)"""
+    handler = make_telegram_handler(mock) if isinstance(mock, MockTelegram) else make_handler(mock)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def generate_tweets(mock, rate, media_share=0.0, stop_at=None):
+    """Post tweets from random accounts at `rate` per second (Poisson arrivals)"""
+    usernames = [u["username"] for u in mock.users.values()]
+    while stop_at is None or time.time() < stop_at:
+        time.sleep(random.expovariate(rate))
+        mock.post_tweet(random.choice(usernames), photo=random.random() < media_share)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--accounts", default="alice,bob,carol", help="comma-separated usernames")
+    parser.add_argument("--tweet-rate", type=float, default=0.2, help="tweets per second across all accounts")
+    parser.add_argument("--media-share", type=float, default=0.0, help="fraction of tweets with a photo")
+    parser.add_argument("--heartbeat", type=float, default=20.0, help="seconds between stream keep-alives")
+    parser.add_argument("--stall-after", type=float, default=None, help="stop stream heartbeats after N seconds")
+    parser.add_argument("--rate-limit", type=int, default=None, help="requests per token per endpoint per window")
+    parser.add_argument("--rate-window", type=float, default=900.0, help="rate-limit window in seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every X response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds per X response")
+    parser.add_argument("--burst-every", type=float, default=None, help="start a 429 burst every N seconds")
+    parser.add_argument("--burst-length", type=float, default=5.0, help="seconds each 429 burst lasts")
+    parser.add_argument("--telegram-port", type=int, default=None, help="also serve a Telegram Bot API stand-in")
+    parser.add_argument("--telegram-throttle-every", type=int, default=None, help="answer every Nth Telegram call with 429")
+    args = parser.parse_args()
+
+    mock_x = MockX(
+        args.accounts.split(","), args.heartbeat, args.stall_after,
+        rate_limit=args.rate_limit, rate_window=args.rate_window, latency=args.latency, jitter=args.jitter,
+        burst_every=args.burst_every, burst_length=args.burst_length,
+    )
+    start_server(mock_x, args.port)
+    print(f"Mock X API on http://127.0.0.1:{args.port} with accounts: {args.accounts}")
+    if args.telegram_port is not None:
+        start_server(MockTelegram(throttle_every=args.telegram_throttle_every), args.telegram_port)
+        print(f"Mock Telegram Bot API on http://127.0.0.1:{args.telegram_port}")
+    if args.tweet_rate > 0:
+        threading.Thread(target=generate_tweets, args=(mock_x, args.tweet_rate, args.media_share), daemon=True).start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass